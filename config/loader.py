@@ -35,6 +35,7 @@ class StrategyConfig(BaseModel):
     stop_loss_pct: float = Field(default=-1.0, description="고정 손절 기준 (%)")
     partial_take_profit_pct: Optional[float] = Field(default=1.5, description="부분 익절 목표 수익률 (%). None이면 사용 안 함")
     partial_take_profit_ratio: float = Field(default=0.4, description="부분 익절 시 매도 비율 (예: 0.4 = 40%)")
+    stop_loss_vwap_pct: Optional[float] = Field(default=None, description="VWAP 하향 이탈 손절 기준 (%). None이면 VWAP 단순 이탈 시 손절")
     time_stop_hour: int = Field(default=14, description="시간 청산 기준 (시)")
     time_stop_minute: int = Field(default=50, description="시간 청산 기준 (분)")
 
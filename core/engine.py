@@ -3,15 +3,15 @@ import pandas as pd
 from loguru import logger
 import numpy as np
 import math
+import time
 from datetime import datetime, timedelta
 from typing import Dict, List, Optional, Set, Callable, Any
 import json
-import traceback # 상세 오류 로깅을 위해 추가
 
 from config.loader import config
 from gateway.kiwoom_api import KiwoomAPI
 
-from data.manager import preprocess_chart_data, update_ohlcv_with_candle
+from data.manager import preprocess_chart_data, preprocess_volume_surge_rank, update_ohlcv_with_candle
 
 from data.indicators import (
     add_vwap, calculate_orb, add_ema, 
@@ -20,6 +20,8 @@ from data.indicators import (
 from strategy.momentum_orb import check_breakout_signal
 from strategy.risk_manager import manage_position
 
+_LOG_LEVELS = frozenset({"DEBUG", "INFO", "WARNING", "ERROR", "CRITICAL"})
+
 # --- 👇 실시간 트레이딩 엔진 클래스 ---
 class TradingEngine:
   """웹소켓 기반 실시간 다중 종목 트레이딩 로직 관장 엔진"""
@@ -74,16 +76,14 @@ class TradingEngine:
     self.screening_min_surge_rate = self.config.strategy.screening_min_surge_rate
 
   def add_log(self, message: str, level: str = "INFO"):
-    log_msg = f"[{datetime.now().strftime('%H:%M:%S')}] {message}" 
+    # 대시보드용 시각 표시는 time.strftime으로 (datetime 객체 생성 없이 현재 로컬 시각 포맷)
+    log_msg = f"[{time.strftime('%H:%M:%S')}] {message}" 
     self.logs.insert(0, log_msg)
     if len(self.logs) > 100: self.logs.pop()
 
-    if level.upper() == "DEBUG": logger.debug(message)
-    elif level.upper() == "INFO": logger.info(message)
-    elif level.upper() == "WARNING": logger.warning(message)
-    elif level.upper() == "ERROR": logger.error(message)
-    elif level.upper() == "CRITICAL": logger.critical(message)
-    else: logger.info(message)
+    level = level.upper()
+    if level not in _LOG_LEVELS: level = "INFO"
+    logger.log(level, message)
 
   # --- 대시보드 연동을 위한 설정 업데이트 메서드 ---
   def update_strategy_settings(self, settings: Dict):
@@ -179,7 +179,13 @@ class TradingEngine:
                 self.last_screening_time = now.replace(tzinfo=None) 
                 self.add_log("   스크리닝 완료.", level="DEBUG")
 
-            await asyncio.sleep(5) # 스크리닝 루프 지연 (CPU 사용량 조절)
+            # 5초마다 깨어나 확인하는 대신 다음 스크리닝 시각까지 대기, 종료 신호가 오면 즉시 깨어남
+            # (대시보드에서 주기를 줄인 경우도 반영되도록 한 번에 최대 60초만 대기)
+            remaining = (self.last_screening_time + self.screening_interval - datetime.now()).total_seconds()
+            try:
+                await asyncio.wait_for(self._stop_event.wait(), timeout=min(max(remaining, 0.0), 60.0))
+            except asyncio.TimeoutError:
+                pass
 
     except asyncio.CancelledError:
         self.add_log("🔶 엔진 메인 루프 취소됨 (종료 신호 수신).", level="WARNING")
@@ -263,32 +269,17 @@ class TradingEngine:
              return
 
         if rank_data.get('return_code') in [0, '0'] and 'trde_qty_sdnin' in rank_data:
-            potential_targets = []
-            for item in rank_data.get('trde_qty_sdnin', []):
-                try:
-                    code = item.get('stk_cd', '').strip()
-                    name = item.get('stk_nm', '').strip()
-                    surge_rate_str = item.get('sdnin_rt', '0').replace('+','').replace('-','').strip()
-                    current_price_str = item.get('cur_prc', '0').replace('+','').replace('-','').strip()
-                    volume_str = item.get('now_trde_qty', '0').strip()
-
-                    if not code or not name: continue 
-
-                    surge_rate = float(surge_rate_str) if surge_rate_str else 0.0
-                    current_price = int(current_price_str) if current_price_str else 0
-                    volume = int(volume_str) if volume_str else 0
-
-                    if (surge_rate >= self.screening_min_surge_rate and
-                        current_price >= self.screening_min_price and
-                        volume >= self.screening_min_volume_threshold * 10000): 
-                        potential_targets.append({'code': code, 'name': name, 'surge_rate': surge_rate})
-                except (ValueError, TypeError) as parse_e:
-                    self.add_log(f"   ⚠️ [SCREEN] 데이터 파싱 오류: {parse_e}, Item: {item}", level="WARNING") 
-                    continue
-
-            potential_targets.sort(key=lambda x: x['surge_rate'], reverse=True)
-            
-            new_targets = {item['code'] for item in potential_targets[:self.max_target_stocks]}
+            surge = preprocess_volume_surge_rank(rank_data.get('trde_qty_sdnin', []))
+            # 조건 필터는 종목별 파이썬 루프 대신 배열 비교 한 번으로 처리 (NaN 값은 비교에서 자동 제외)
+            mask = ((surge['code'] != '') & (surge['name'] != '') &
+                    (surge['surge_rate'] >= self.screening_min_surge_rate) &
+                    (surge['price'] >= self.screening_min_price) &
+                    (surge['volume'] >= self.screening_min_volume_threshold * 10000))
+            selected = np.flatnonzero(mask)
+            # 급증률 내림차순 (안정 정렬이므로 동률은 API 순서 유지)
+            selected = selected[np.argsort(-surge['surge_rate'][selected], kind='stable')]
+
+            new_targets = set(surge['code'][selected[:self.max_target_stocks]].tolist())
             self.target_stocks = new_targets # 감시 대상 목록 자체를 업데이트
 
             # --- 실시간 구독 관리 ---
@@ -328,10 +319,11 @@ class TradingEngine:
         self.add_log(f"   ➕ [SUB_UPDATE] 구독 추가 요청: {codes_to_add}", level="DEBUG")
 
         # --- ❗️ [신규] 신규 추가된 종목의 1분봉 차트 이력 가져오기 ---
+        codes_to_init = [code for code in codes_to_add if code not in self.ohlcv_data] # 아직 데이터가 없는 경우에만
+        if codes_to_init:
+            self.add_log(f"   🔄 [SUB_UPDATE] 신규 종목 ({codes_to_init}) 1분봉 차트 이력 조회 시작...", level="DEBUG")
+            asyncio.create_task(self._initialize_stocks_data(codes_to_init))
         for code in codes_to_add:
-            if code not in self.ohlcv_data: # 아직 데이터가 없는 경우에만
-                self.add_log(f"   🔄 [SUB_UPDATE] 신규 종목 ({code}) 1분봉 차트 이력 조회 시작...", level="DEBUG")
-                asyncio.create_task(self._initialize_stock_data(code))
             # 캔들 집계기 초기화
             self.current_candle.pop(code, None) 
             self.cumulative_volumes.pop(code, None)
@@ -354,12 +346,16 @@ class TradingEngine:
             self.ohlcv_data.pop(code, None) # ❗️ 차트 데이터도 제거
             self.current_candle.pop(code, None) # ❗️ 집계 중인 캔들도 제거
 
-  async def _initialize_stock_data(self, stock_code: str):
-    """(1회성) 1분봉 차트 이력을 조회하여 ohlcv_data에 저장"""
+  async def _initialize_stocks_data(self, stock_codes: List[str]):
+    """(1회성) 신규 종목들의 1분봉 차트 이력을 한 번에 조회하여 ohlcv_data에 저장 (동시 요청 수는 API의 FAN_OUT_CONCURRENCY로 제한)"""
     if not self.api: return
+    chart_results = await self.api.fetch_minute_charts_many(stock_codes, timeframe=1)
+    for stock_code, chart_data in chart_results.items():
+        self._initialize_stock_data(stock_code, chart_data)
+
+  def _initialize_stock_data(self, stock_code: str, chart_data: Optional[Dict]):
+    """(1회성) 조회한 1분봉 차트 이력을 DataFrame으로 변환하여 ohlcv_data에 저장"""
     try:
-        chart_data = await self.api.fetch_minute_chart(stock_code, timeframe=1)
-        
         if chart_data is None or chart_data.get('return_code') != 0 or 'stk_min_pole_chart_qry' not in chart_data:
             msg = chart_data.get('return_msg', '분봉 API 오류') if chart_data else '분봉 API 호출 실패'
             self.add_log(f"  ⚠️ [{stock_code}] (초기화) 분봉 데이터 API 오류: {msg}", level="WARNING")
@@ -424,38 +420,25 @@ class TradingEngine:
     try:
         trnm = ws_data.get('trnm')
         if trnm == 'REAL':
-            realtime_data_list = ws_data.get('data')
-            if isinstance(realtime_data_list, list):
-                for item_data in realtime_data_list:
-                    data_type = item_data.get('type')
-                    item_code_raw = item_data.get('item', '')
-                    values = item_data.get('values')
-
-                    if not data_type or not values:
-                        self.add_log(f"⚠️ 실시간 데이터 항목 형식 오류 (type/values 누락): {item_data}", level="WARNING") 
-                        continue
-
-                    stock_code = None
-                    if item_code_raw:
-                        stock_code = item_code_raw[1:] if item_code_raw.startswith('A') else item_code_raw
-                        if stock_code.endswith(('_NX', '_AL')): stock_code = stock_code[:-3]
-
-                    # 비동기 처리 예약
-                    if data_type == '0B' and stock_code: # 체결
-                        # ❗️ 수정: item_data['item'] 대신 정제된 stock_code 전달
-                        asyncio.create_task(self._process_realtime_execution(stock_code, values))
-                    elif data_type == '0D' and stock_code: # 호가
-                        # ❗️ 수정: item_data['item'] 대신 정제된 stock_code 전달
-                        asyncio.create_task(self._process_realtime_orderbook(stock_code, values))
-                    elif data_type == '00': # 주문 체결 통보
-                        # ❗️ 수정: stock_code가 None일 수 있음 (정상)
-                        asyncio.create_task(self._process_execution_update(stock_code, values))
-                    elif data_type == '04' and stock_code: # 잔고 통보
-                        # ❗️ 수정: item_data['item'] 대신 정제된 stock_code 전달
-                        asyncio.create_task(self._process_balance_update(stock_code, values))
-                    elif data_type == '1h' and stock_code: # VI 발동/해제
-                         # ❗️ 수정: item_data['item'] 대신 정제된 stock_code 전달
-                         asyncio.create_task(self._process_vi_update(stock_code, values))
+            # KiwoomAPI가 실시간 항목 1건({'trnm', 'type', 'item', 'values'})씩 전달 (item은 정제된 종목코드 또는 None)
+            data_type = ws_data.get('type')
+            stock_code = ws_data.get('item')
+            values = ws_data.get('values')
+
+            # 비동기 처리 예약
+            if data_type == '0B' and stock_code: # 체결
+                asyncio.create_task(self._process_realtime_execution(stock_code, values))
+            elif data_type == '0D' and stock_code: # 호가
+                asyncio.create_task(self._process_realtime_orderbook(stock_code, values))
+            elif data_type == '00': # 주문 체결 통보
+                # ❗️ 수정: stock_code가 None일 수 있음 (정상)
+                self.api.invalidate_account_balance() # 체결로 예수금이 바뀌므로 캐시 폐기
+                asyncio.create_task(self._process_execution_update(stock_code, values))
+            elif data_type == '04' and stock_code: # 잔고 통보
+                self.api.invalidate_account_balance()
+                asyncio.create_task(self._process_balance_update(stock_code, values))
+            elif data_type == '1h' and stock_code: # VI 발동/해제
+                 asyncio.create_task(self._process_vi_update(stock_code, values))
 
         elif trnm in ['REG', 'REMOVE']:
             return_code_raw = ws_data.get('return_code'); return_msg = ws_data.get('return_msg', '')
@@ -481,17 +464,16 @@ class TradingEngine:
 
         if not last_price_str or not exec_vol_signed_str or not exec_time_str: return
 
-        last_price = float(last_price_str.replace('+','').replace('-','').strip())
-        exec_vol_signed = int(exec_vol_signed_str.strip())
+        last_price = float(last_price_str.strip().lstrip('+-'))
+        exec_vol_signed = int(exec_vol_signed_str) # int()는 부호/공백을 직접 처리
         exec_vol_abs = abs(exec_vol_signed) # 절대 거래량
         now = datetime.now()
         
-        # KST 기준 시간 객체 생성 (체결 시간 사용)
+        # KST 기준 시간 객체 생성 (체결 시간 HHMMSS 사용)
+        # 틱마다 날짜 문자열을 만들어 strptime으로 다시 파싱하지 않고, 오늘 날짜에 시/분/초만 교체
         try:
-            current_time = datetime.strptime(
-                f"{now.year}-{now.month}-{now.day} {exec_time_str}", 
-                "%Y-%m-%d %H%M%S"
-            )
+            current_time = now.replace(hour=int(exec_time_str[0:2]), minute=int(exec_time_str[2:4]),
+                                       second=int(exec_time_str[4:6]), microsecond=0)
         except ValueError:
             current_time = now # 파싱 실패 시 현재 시간 사용
 
@@ -660,6 +642,21 @@ class TradingEngine:
         self.add_log(f"  🚨 [RT_EXEC] ({stock_code}) 예상치 못한 오류: {e}", level="ERROR") 
         logger.exception(e)
 
+  def _compute_candle_indicators(self, df: pd.DataFrame):
+    """
+    분봉 DataFrame 사본에 VWAP/EMA를 계산하고 ORB 레벨과 RVOL을 계산합니다. (워커 스레드에서 실행)
+    원본은 이벤트 루프의 틱 처리 태스크가 함께 읽으므로 수정하지 않고, 지표 컬럼 값만 반환합니다.
+    Returns: ({지표 컬럼명: 값 배열}, ORB 레벨, RVOL)
+    """
+    ema_short_period = self.config.strategy.ema_short_period; ema_long_period = self.config.strategy.ema_long_period
+    add_vwap(df)
+    add_ema(df, short_period=ema_short_period, long_period=ema_long_period)
+    orb_levels_series = calculate_orb(df, timeframe=self.orb_timeframe)
+    rvol = calculate_rvol(df, window=self.config.strategy.rvol_period)
+    indicator_cols = ['vwap', f'EMA_{ema_short_period}', f'EMA_{ema_long_period}']
+    indicator_values = {col: df[col].to_numpy() for col in indicator_cols if col in df.columns}
+    return indicator_values, orb_levels_series, rvol
+
   async def _handle_new_candle(self, stock_code: str, completed_candle: Dict[str, Any]):
     """
     완성된 1분봉 캔들을 받아 DataFrame에 추가하고, 
@@ -690,16 +687,15 @@ class TradingEngine:
             total_bid_vol = int(orderbook_ws_data.get('total_bid_vol', 0))
         
         # --- 지표 계산 시 self의 동적 설정값 사용 ---
-        add_vwap(df)
-        add_ema(df, short_period=self.config.strategy.ema_short_period, long_period=self.config.strategy.ema_long_period)
-        
-        orb_levels_series = calculate_orb(df, timeframe=self.orb_timeframe)
+        # 여러 종목의 분봉이 동시에 완성되어도 이벤트 루프(틱 수신)가 막히지 않도록 워커 스레드에서 계산
+        # (pandas/numpy 연산은 대부분 GIL을 놓으므로 종목별 계산이 병렬로 진행됨)
+        # 워커 스레드에는 사본을 넘기고, 계산된 지표 컬럼은 이벤트 루프 스레드에서 원본에 반영
+        indicator_values, orb_levels_series, rvol = await asyncio.to_thread(self._compute_candle_indicators, df.copy())
+        for col, values in indicator_values.items(): df[col] = values
         
         # ❗️ 계산된 ORB 레벨을 엔진 변수에 저장
         self.orb_levels[stock_code] = orb_levels_series.to_dict()
         
-        rvol_period = self.config.strategy.rvol_period
-        rvol = calculate_rvol(df, window=rvol_period)
         # ... (나머지 지표 계산 동일) ...
         cumulative_vols = self.cumulative_volumes.get(stock_code)
         strength_val = None
@@ -958,6 +954,18 @@ class TradingEngine:
         self.add_log(f"🚨 [RT_BALANCE] ({stock_code}) 잔고 처리 오류: {e}", level="ERROR") 
         logger.exception(e) 
 
+  async def _liquidate_position(self, stock_code: str, quantity: int):
+    """(킬 스위치) 단일 포지션 시장가 청산 주문 및 상태 갱신"""
+    self.add_log(f"     -> [KILL] 시장가 청산 시도 ({stock_code} {quantity}주)...", level="WARNING") 
+    result = await self.api.create_sell_order(stock_code, quantity) 
+    if result and result.get('return_code') == 0:
+        if stock_code in self.positions: self.positions[stock_code].update({'status': 'PENDING_EXIT', 'exit_signal': 'KILL_SWITCH', 'order_no': result.get('ord_no'), 'original_size_before_exit': quantity, 'filled_qty': 0, 'filled_value': 0.0 })
+        self.add_log(f"     ✅ [KILL] 시장가 청산 주문 접수 ({stock_code} {quantity}주)", level="INFO") 
+    else:
+        error_info = result.get('return_msg', '주문 실패') if result else 'API 호출 실패'
+        self.add_log(f"     ❌ [KILL] 시장가 청산 주문 실패 ({stock_code} {quantity}주): {error_info}", level="ERROR") 
+        if stock_code in self.positions: self.positions[stock_code]['status'] = 'ERROR_LIQUIDATION' 
+
   async def execute_kill_switch(self):
     self.add_log("🚨🚨🚨 [KILL SWITCH] 긴급 정지 발동! 모든 포지션 시장가 청산 시도! 🚨🚨🚨", level="CRITICAL") 
     self.engine_status = "KILL_SWITCH_ACTIVATED"
@@ -967,20 +975,17 @@ class TradingEngine:
         positions_to_liquidate = self.positions.copy() 
         self.add_log(f"  -> [KILL] 청산 대상 포지션 {len(positions_to_liquidate)}개 확인.", level="INFO") 
 
+        # 청산 주문은 서로 독립적이므로 종목별로 순차 대기하지 않고 동시에 전송
+        liquidations = []
         for stock_code, pos_info in positions_to_liquidate.items():
             if pos_info.get('status') == 'IN_POSITION' and pos_info.get('size', 0) > 0:
-                quantity = pos_info['size']
-                self.add_log(f"     -> [KILL] 시장가 청산 시도 ({stock_code} {quantity}주)...", level="WARNING") 
-                result = await self.api.create_sell_order(stock_code, quantity) 
-                if result and result.get('return_code') == 0:
-                    if stock_code in self.positions: self.positions[stock_code].update({'status': 'PENDING_EXIT', 'exit_signal': 'KILL_SWITCH', 'order_no': result.get('ord_no'), 'original_size_before_exit': quantity, 'filled_qty': 0, 'filled_value': 0.0 })
-                    self.add_log(f"     ✅ [KILL] 시장가 청산 주문 접수 ({stock_code} {quantity}주)", level="INFO") 
-                else:
-                    error_info = result.get('return_msg', '주문 실패') if result else 'API 호출 실패'
-                    self.add_log(f"     ❌ [KILL] 시장가 청산 주문 실패 ({stock_code} {quantity}주): {error_info}", level="ERROR") 
-                    if stock_code in self.positions: self.positions[stock_code]['status'] = 'ERROR_LIQUIDATION' 
+                liquidations.append(self._liquidate_position(stock_code, pos_info['size']))
             elif pos_info.get('status') in ['PENDING_ENTRY', 'PENDING_EXIT']:
                 self.add_log(f"     ℹ️ [KILL] 주문 진행 중 포지션({stock_code}) 확인. 미체결 취소 필요.", level="INFO") 
+        if liquidations:
+            for result in await self.api.gather_bounded(liquidations):
+                if isinstance(result, Exception):
+                    self.add_log(f"     ❌ [KILL] 청산 처리 중 예외: {result}", level="ERROR")
 
         self.add_log("  <- [KILL] 시장가 청산 주문 접수 완료.", level="INFO") 
     else:
@@ -1,48 +1,70 @@
 # data/indicators.py
+import threading
 import pandas as pd
 import numpy as np
-from typing import Dict, Optional
+from datetime import date, datetime, timedelta, timezone
+from typing import Dict, Optional, Tuple
+from loguru import logger
 from config.loader import config # 설정 로더 추가
 
+# KST는 서머타임이 없으므로 고정 오프셋으로 '오늘 날짜'만 빠르게 구함 (tz DB 조회 회피)
+_KST_OFFSET = timezone(timedelta(hours=9))
+# {(날짜, timeframe): (장 시작 시각, ORB 종료 시각)} - 하루 동안 동일하므로 재사용
+# 분봉 인덱스는 수집 단계(preprocess_chart_data / 실시간 캔들)부터 tz 정보 없는 KST 시각이므로 경계도 naive로 보관
+_orb_window_cache: Dict[Tuple[date, int], Tuple[pd.Timestamp, pd.Timestamp]] = {}
+# 엔진이 워커 스레드에서 calculate_orb를 동시에 호출하므로 캐시 갱신(이전 날짜 정리 포함)은 잠금 안에서 수행
+_orb_window_lock = threading.Lock()
+
+def _get_orb_window(timeframe: int) -> Tuple[pd.Timestamp, pd.Timestamp]:
+  """오늘(KST) 장 시작(09:00)과 ORB 종료 시각을 반환합니다. 날짜별로 1회만 계산합니다."""
+  today = datetime.now(_KST_OFFSET).date()
+  key = (today, timeframe)
+  with _orb_window_lock:
+    bounds = _orb_window_cache.get(key)
+    if bounds is None:
+      # 날짜가 바뀌면 이전 날짜 항목은 더 이상 쓰이지 않으므로 정리
+      for stale_key in [k for k in _orb_window_cache if k[0] != today]:
+        del _orb_window_cache[stale_key]
+      start_time_obj = pd.Timestamp(today) + pd.Timedelta(hours=9)
+      bounds = (start_time_obj, start_time_obj + pd.Timedelta(minutes=timeframe))
+      _orb_window_cache[key] = bounds
+  return bounds
+
 def calculate_orb(df: pd.DataFrame, timeframe: int = 15) -> pd.Series:
   """
   개장 후 특정 시간(timeframe) 동안의 고가(ORH)와 저가(ORL)를 계산합니다.
   """
   try:
-    now_kst = pd.Timestamp.now(tz='Asia/Seoul')
-    start_time_obj = now_kst.normalize() + pd.Timedelta(hours=9)
-    orb_end_time_obj = start_time_obj + pd.Timedelta(minutes=timeframe)
-    start_time_str = start_time_obj.strftime('%H:%M:%S') # 초 포함
-    orb_end_time_str = orb_end_time_obj.strftime('%H:%M:%S') # 초 포함
+    start_time_obj, orb_end_time_obj = _get_orb_window(timeframe)
 
     if df.empty:
-        print("🔍 [DEBUG_ORB] 원본 DataFrame 비어 있음.")
+        logger.debug("🔍 [DEBUG_ORB] 원본 DataFrame 비어 있음.")
         return pd.Series({'orh': None, 'orl': None}) # 빈 Series 반환
 
-    # DataFrame 인덱스가 시간대 정보를 가지고 있는지 확인하고 통일
-    if df.index.tz is None:
-        df_tz_aware = df.tz_localize('Asia/Seoul', ambiguous='infer')
-    elif str(df.index.tz) != 'Asia/Seoul': # 문자열 비교로 변경
-        df_tz_aware = df.tz_convert('Asia/Seoul')
-    else:
-        df_tz_aware = df
+    # 인덱스는 수집 시점에 naive KST로 통일되어 있음 (매 호출마다 tz 변환 사본을 만들지 않음)
+    assert df.index.tz is None, "OHLCV 인덱스는 tz 정보 없는 KST 시각이어야 합니다."
 
     # 시작 시간 이후, ORB 종료 시간 *이전* 데이터 선택 (종료 시간 미포함)
-    opening_range_df = df_tz_aware[(df_tz_aware.index >= start_time_obj) & (df_tz_aware.index < orb_end_time_obj)]
+    if df.index.is_monotonic_increasing:
+      # 시간순으로 정렬된 인덱스면 이진 탐색으로 구간만 잘라냄
+      start_pos = df.index.searchsorted(start_time_obj, side='left')
+      end_pos = df.index.searchsorted(orb_end_time_obj, side='left')
+      opening_range_df = df.iloc[start_pos:end_pos]
+    else:
+      # 실시간 캔들 추가(concat)로 순서가 어긋난 경우에는 정렬 여부와 무관한 시간 마스크로 선택
+      opening_range_df = df[(df.index >= start_time_obj) & (df.index < orb_end_time_obj)]
 
     if not opening_range_df.empty:
       orh = opening_range_df['high'].max()
       orl = opening_range_df['low'].min()
-      print(f"✅ ORB 계산 완료 ({start_time_obj.strftime('%H:%M')}~{orb_end_time_obj.strftime('%H:%M')}): ORH={orh}, ORL={orl}")
+      logger.debug("✅ ORB 계산 완료 ({:%H:%M}~{:%H:%M}): ORH={}, ORL={}", start_time_obj, orb_end_time_obj, orh, orl)
       return pd.Series({'orh': orh, 'orl': orl})
     else:
-      print(f"⚠️ ORB 계산 데이터 부족 ({start_time_obj.strftime('%H:%M')} ~ {orb_end_time_obj.strftime('%H:%M')}).")
+      logger.debug("⚠️ ORB 계산 데이터 부족 ({:%H:%M} ~ {:%H:%M}).", start_time_obj, orb_end_time_obj)
       return pd.Series({'orh': None, 'orl': None})
 
   except Exception as e:
-    print(f"❌ ORB 계산 중 오류: {e}")
-    import traceback
-    print(traceback.format_exc()) # 상세 오류 출력
+    logger.exception("❌ ORB 계산 중 오류: {}", e) # 스택 트레이스는 로거가 필요할 때만 포맷
     return pd.Series({'orh': None, 'orl': None})
 
 
@@ -52,25 +74,68 @@ def add_vwap(df: pd.DataFrame):
     # high, low 컬럼도 확인
     required_cols = ['high', 'low', 'close', 'volume']
     if all(col in df.columns for col in required_cols):
+        # 가격 컬럼은 float32로 저장되지만, 누적합(가격×거래량)은 정밀도 유지를 위해 float64로 계산
+        high = df['high'].to_numpy(dtype=np.float64)
+        low = df['low'].to_numpy(dtype=np.float64)
+        close = df['close'].to_numpy(dtype=np.float64)
+        volume = df['volume'].to_numpy(dtype=np.float64)
         # typical_price 계산 (고가+저가+종가)/3
-        typical_price = (df['high'] + df['low'] + df['close']) / 3
-        cumulative_pv = (typical_price * df['volume']).cumsum()
-        cumulative_volume = df['volume'].cumsum()
+        typical_price = (high + low + close) / 3
+        cumulative_pv = np.cumsum(typical_price * volume)
+        cumulative_volume = np.cumsum(volume)
         # 0으로 나누는 경우 방지: cumulative_volume이 0이면 NaN 반환
-        df['vwap'] = cumulative_pv / cumulative_volume.replace(0, np.nan) # np.nan 사용
-        print("✅ VWAP 지표 추가 완료 (직접 계산)")
+        df['vwap'] = cumulative_pv / np.where(cumulative_volume == 0, np.nan, cumulative_volume)
+        logger.debug("✅ VWAP 지표 추가 완료 (직접 계산)")
     else:
         missing_cols = [col for col in required_cols if col not in df.columns]
-        print(f"⚠️ VWAP 계산 필요 컬럼 부족: {missing_cols}")
+        logger.warning("⚠️ VWAP 계산 필요 컬럼 부족: {}", missing_cols)
         if 'vwap' not in df.columns: df['vwap'] = np.nan # NaN 컬럼 생성
 
   except Exception as e:
-    print(f"❌ VWAP 계산 중 오류: {e}")
+    logger.error("❌ VWAP 계산 중 오류: {}", e)
     if 'vwap' not in df.columns: df['vwap'] = np.nan
 
 
+# EMA 평활 계수 테이블 {period: alpha} - ewm(span=period, adjust=False)와 동일한 alpha = 2 / (span + 1)
+_ema_alpha_table: Dict[int, float] = {}
+
+def _ema_alpha(period: int) -> float:
+    alpha = _ema_alpha_table.get(period)
+    if alpha is None:
+        alpha = 2.0 / (period + 1.0)
+        _ema_alpha_table[period] = alpha
+    return alpha
+
+
+def _update_ema_column(df: pd.DataFrame, col: str, period: int):
+    """
+    EMA 컬럼을 갱신합니다. 이전 봉까지의 EMA가 이미 계산되어 있으면 새로 추가된(또는 덮어쓴 마지막) 봉만
+    점화식 ema[i] = ema[i-1] + alpha * (close[i] - ema[i-1]) 으로 이어서 계산하고, 아니면 전체를 ewm으로 계산합니다.
+    """
+    close = df['close'].to_numpy(dtype=np.float64)
+    n = len(close)
+    if col in df.columns:
+        ema = df[col].to_numpy(dtype=np.float64, copy=True)
+        missing = np.flatnonzero(np.isnan(ema))
+        # 마지막 봉은 같은 분 캔들이 덮어써졌을 수 있으므로 항상 다시 계산
+        start = min(missing[0], n - 1) if missing.size else n - 1
+        tail = close[start:]
+        if start >= 1 and not np.isnan(ema[start - 1]) and not np.isnan(tail).any():
+            alpha = _ema_alpha(period)
+            prev = ema[start - 1]
+            for i in range(start, n):
+                prev += alpha * (close[i] - prev)
+                ema[i] = prev
+            df[col] = ema
+            return
+    df[col] = df['close'].ewm(span=period, adjust=False).mean()
+
+
 def add_ema(df: pd.DataFrame, short_period: int = 9, long_period: int = 20):
-    """DataFrame에 단기 및 장기 EMA를 계산하여 추가합니다 (pandas ewm 사용)."""
+    """
+    DataFrame에 단기 및 장기 EMA를 계산하여 추가합니다.
+    이미 계산된 EMA 컬럼이 있으면 새로 추가된 봉만 이어서 계산합니다 (없으면 pandas ewm 사용).
+    """
     try:
         ema_short_col = f'EMA_{short_period}'
         ema_long_col = f'EMA_{long_period}'
@@ -78,25 +143,25 @@ def add_ema(df: pd.DataFrame, short_period: int = 9, long_period: int = 20):
         if 'close' in df.columns:
              # 데이터가 충분한지 확인 (최소 기간 이상)
              if len(df) >= short_period:
-                 df[ema_short_col] = df['close'].ewm(span=short_period, adjust=False).mean()
+                 _update_ema_column(df, ema_short_col, short_period)
              else:
-                 print(f"⚠️ 단기 EMA({short_period}) 계산 위한 데이터 부족 (필요: {short_period}, 현재: {len(df)})")
+                 logger.debug("⚠️ 단기 EMA({}) 계산 위한 데이터 부족 (필요: {}, 현재: {})", short_period, short_period, len(df))
                  if ema_short_col not in df.columns: df[ema_short_col] = np.nan
 
              if len(df) >= long_period:
-                 df[ema_long_col] = df['close'].ewm(span=long_period, adjust=False).mean()
+                 _update_ema_column(df, ema_long_col, long_period)
              else:
-                  print(f"⚠️ 장기 EMA({long_period}) 계산 위한 데이터 부족 (필요: {long_period}, 현재: {len(df)})")
+                  logger.debug("⚠️ 장기 EMA({}) 계산 위한 데이터 부족 (필요: {}, 현재: {})", long_period, long_period, len(df))
                   if ema_long_col not in df.columns: df[ema_long_col] = np.nan
 
              if len(df) >= max(short_period, long_period):
-                  print(f"✅ EMA({short_period}/{long_period}) 지표 추가 완료")
+                  logger.debug("✅ EMA({}/{}) 지표 추가 완료", short_period, long_period)
         else:
-            print("⚠️ EMA 계산 필요 컬럼('close') 없음.")
+            logger.warning("⚠️ EMA 계산 필요 컬럼('close') 없음.")
             if ema_short_col not in df.columns: df[ema_short_col] = np.nan
             if ema_long_col not in df.columns: df[ema_long_col] = np.nan
     except Exception as e:
-        print(f"❌ EMA 계산 중 오류: {e}")
+        logger.error("❌ EMA 계산 중 오류: {}", e)
         ema_short_col = f'EMA_{short_period}'
         ema_long_col = f'EMA_{long_period}'
         if ema_short_col not in df.columns: df[ema_short_col] = np.nan
@@ -113,23 +178,24 @@ def calculate_rvol(df: pd.DataFrame, window: int = 20) -> Optional[float]:
         Optional[float]: 계산된 RVOL 값 (%), 계산 불가 시 None
     """
     if df is None or df.empty or 'volume' not in df.columns or len(df) < window + 1:
-        print(f"⚠️ RVOL({window}) 계산 불가: 데이터 부족 (필요: {window + 1}개, 현재: {len(df)}개)")
+        logger.debug("⚠️ RVOL({}) 계산 불가: 데이터 부족 (필요: {}개, 현재: {}개)", window, window + 1, len(df) if df is not None else 0)
         return None
     try:
-        current_volume = df['volume'].iloc[-1]
+        # Series 슬라이스/mean 대신 numpy 배열 뷰에서 직접 합산 (매 봉마다 Series 객체 생성 회피)
+        volumes = df['volume'].to_numpy()
+        current_volume = volumes[-1]
         # 현재 봉 제외하고 이전 window 개수만큼 선택
-        previous_volumes = df['volume'].iloc[-(window + 1):-1]
-        avg_previous_volume = previous_volumes.mean()
+        avg_previous_volume = volumes[-(window + 1):-1].sum(dtype=np.float64) / window
 
         if pd.isna(avg_previous_volume) or avg_previous_volume <= 0:
-            print(f"⚠️ RVOL({window}) 계산 불가: 이전 평균 거래량({avg_previous_volume})이 유효하지 않음.")
+            logger.debug("⚠️ RVOL({}) 계산 불가: 이전 평균 거래량({})이 유효하지 않음.", window, avg_previous_volume)
             return None
 
         rvol = (current_volume / avg_previous_volume) * 100
-        print(f"✅ RVOL({window}) 계산 완료: {rvol:.2f}% (현재:{current_volume:.0f}/평균:{avg_previous_volume:.0f})")
+        logger.debug("✅ RVOL({}) 계산 완료: {:.2f}% (현재:{:.0f}/평균:{:.0f})", window, rvol, current_volume, avg_previous_volume)
         return rvol
     except Exception as e:
-        print(f"🚨 RVOL({window}) 계산 중 오류: {e}")
+        logger.error("🚨 RVOL({}) 계산 중 오류: {}", window, e)
         return None
 
 
@@ -144,18 +210,18 @@ def calculate_obi(total_bid_volume: Optional[int], total_ask_volume: Optional[in
       계산된 OBI 값 (float, 비율) 또는 계산 불가 시 None
     """
     if total_bid_volume is None or total_ask_volume is None:
-        print("⚠️ OBI 계산 입력값 누락.")
+        logger.debug("⚠️ OBI 계산 입력값 누락.")
         return None
     if total_ask_volume <= 0:
         # 매도 잔량이 0이면 매우 강한 매수세 또는 호가 공백. 매우 큰 값 또는 None 반환.
-        print("⚠️ OBI 계산: 매도 잔량 0. (매우 강한 매수세 또는 호가 공백)")
+        logger.debug("⚠️ OBI 계산: 매도 잔량 0. (매우 강한 매수세 또는 호가 공백)")
         return 1000.0 # 예시: 매우 큰 값 (설정 가능하게 변경 고려)
     try:
         obi = total_bid_volume / total_ask_volume # 비율 계산
-        print(f"✅ OBI 계산 완료: {obi:.2f} (매수:{total_bid_volume}/매도:{total_ask_volume})")
+        logger.debug("✅ OBI 계산 완료: {:.2f} (매수:{}/매도:{})", obi, total_bid_volume, total_ask_volume)
         return obi
     except Exception as e:
-        print(f"❌ OBI 계산 중 오류: {e}")
+        logger.error("❌ OBI 계산 중 오류: {}", e)
         return None
 
 
@@ -174,16 +240,16 @@ def get_strength(cumulative_buy_volume: int, cumulative_sell_volume: int) -> Opt
     if cumulative_sell_volume <= 0:
         # 매도 체결량이 0이면 (매수만 있었거나 거래가 없었음)
         if cumulative_buy_volume > 0:
-            print("⚠️ Strength 계산: 매도 체결량 0 (매수 우위 극단값)")
+            logger.debug("⚠️ Strength 계산: 매도 체결량 0 (매수 우위 극단값)")
             return 1000.0 # 극단적인 매수 우위 상태 (매우 큰 값 또는 다른 값으로 정의 가능)
         else:
-            # print("⚠️ Strength 계산 불가: 매수/매도 누적 체결량 모두 0") # 로그 너무 많을 수 있어 주석 처리
+            # logger.debug("⚠️ Strength 계산 불가: 매수/매도 누적 체결량 모두 0") # 로그 너무 많을 수 있어 주석 처리
             return None # 거래 자체가 없는 경우
 
     try:
         strength = (cumulative_buy_volume / cumulative_sell_volume) * 100
-        # print(f"✅ Strength 계산 완료: {strength:.2f}% (매수:{cumulative_buy_volume}/매도:{cumulative_sell_volume})") # 로그 너무 많을 수 있어 주석 처리
+        # logger.debug("✅ Strength 계산 완료: {:.2f}% (매수:{}/매도:{})", strength, cumulative_buy_volume, cumulative_sell_volume) # 로그 너무 많을 수 있어 주석 처리
         return strength
     except Exception as e:
-        print(f"❌ Strength 계산 중 오류: {e}")
-        return None
\ No newline at end of file
+        logger.error("❌ Strength 계산 중 오류: {}", e)
+        return None
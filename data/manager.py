@@ -1,18 +1,23 @@
 # Kiwoom API가 보내준 분봉 데이터를 우리가 다루기 쉬운 형태로 변환하는 역할을 합니다.
 
+import numpy as np
 import pandas as pd
+from loguru import logger
 from typing import List, Dict, Optional, Any
 
+OHLCV_COLUMNS = ['open', 'high', 'low', 'close', 'volume']
+PRICE_COLUMNS = ['open', 'high', 'low', 'close']
+# 등락 부호(+/-) 제거용 변환 테이블 (정규식 대신 str.translate 사용)
+_SIGN_TABLE = str.maketrans('', '', '+-')
+
 def preprocess_chart_data(chart_data: List[Dict]) -> Optional[pd.DataFrame]:
     """
     키움 API의 차트 데이터(리스트)를 Pandas DataFrame으로 변환하고 전처리합니다.
     """
     if not chart_data:
-        print("⚠️ 전처리할 차트 데이터가 없습니다.")
+        logger.warning("⚠️ 전처리할 차트 데이터가 없습니다.")
         return None
 
-    df = pd.DataFrame(chart_data)
-
     # 데이터 타입 변환 및 컬럼 이름 변경
     numeric_cols = {
         'cur_prc': 'close',
@@ -21,22 +26,60 @@ def preprocess_chart_data(chart_data: List[Dict]) -> Optional[pd.DataFrame]:
         'high_pric': 'high',
         'low_pric': 'low'
     }
-    
-    for col_from, col_to in numeric_cols.items():
-        df[col_to] = pd.to_numeric(df[col_from].astype(str).str.replace(r'[+-]', '', regex=True), errors='coerce')
-    # 시간 데이터를 datetime 형식으로 변환하고 인덱스로 설정
-    df['datetime'] = pd.to_datetime(df['cntr_tm'], format='%Y%m%d%H%M%S')
-    df = df.set_index('datetime')
-    
+
+    # 응답의 모든 필드로 object DataFrame을 만들지 않고, 필요한 필드만 컬럼(배열) 단위로 한 번에 추출
+    raw_columns = {col_from: np.array([bar[col_from] for bar in chart_data], dtype='U') for col_from in numeric_cols}
+    columns: Dict[str, Any] = {}
+    try:
+        # 키움 숫자 필드는 항상 부호(+/-)가 붙은 정수 문자열이므로, 부호만 떼고 int64로 바로 변환
+        # (to_numeric의 셀 단위 타입 추론/coerce 처리를 건너뜀)
+        for col_from, col_to in numeric_cols.items():
+            columns[col_to] = np.char.lstrip(raw_columns[col_from], '+-').astype(np.int64)
+    except (ValueError, TypeError):
+        # 빈 문자열 등 예외적인 값이 섞인 경우에만 기존의 느슨한 변환으로 처리 (변환 불가 값은 NaN)
+        for col_from, col_to in numeric_cols.items():
+            columns[col_to] = pd.to_numeric(pd.Series(np.char.translate(raw_columns[col_from], _SIGN_TABLE)), errors='coerce').to_numpy()
+    # 시간 데이터를 datetime 형식으로 변환하여 인덱스로 사용
+    index = pd.DatetimeIndex(pd.to_datetime([bar['cntr_tm'] for bar in chart_data], format='%Y%m%d%H%M%S'), name='datetime')
+    df = pd.DataFrame(columns, index=index)
+
     # 필요한 컬럼만 선택하고 순서 정렬
-    df = df[['open', 'high', 'low', 'close', 'volume']]
+    df = df[OHLCV_COLUMNS]
+    # 원화 가격(≤ 10^7)은 float32로도 손실 없이 표현되므로 지표 계산 시 읽는 메모리를 절반으로 줄임
+    df = df.astype({col: np.float32 for col in PRICE_COLUMNS})
     
     # API가 최신 데이터를 가장 먼저 주므로, 시간 순으로 정렬
     df = df.sort_index()
 
-    print("✅ API 데이터를 DataFrame으로 변환 및 정제 완료")
+    logger.debug("✅ API 데이터를 DataFrame으로 변환 및 정제 완료 ({}건)", len(df))
     return df
 
+# 거래량 급증(ka10023) 응답의 숫자 필드 -> 배열 이름
+SURGE_RANK_NUMERIC_COLS = {
+    'sdnin_rt': 'surge_rate',
+    'cur_prc': 'price',
+    'now_trde_qty': 'volume'
+}
+
+def preprocess_volume_surge_rank(rows: List[Dict]) -> Dict[str, np.ndarray]:
+    """
+    거래량 급증(ka10023) 응답의 종목 목록(dict 리스트)을 필드별 배열(code/name/surge_rate/price/volume)로 변환합니다.
+    스크리닝 조건 필터와 정렬을 종목마다 dict를 조회하는 루프 대신 배열 연산으로 처리하기 위함입니다.
+    숫자로 변환할 수 없는 값은 NaN이 되어 이후 비교 조건에서 자연히 제외됩니다.
+    """
+    surge: Dict[str, np.ndarray] = {
+        'code': np.array([row.get('stk_cd', '').strip() for row in rows], dtype='U'),
+        'name': np.array([row.get('stk_nm', '').strip() for row in rows], dtype='U'),
+    }
+    for col_from, col_to in SURGE_RANK_NUMERIC_COLS.items():
+        raw = np.char.lstrip(np.char.strip(np.array([row.get(col_from, '0') for row in rows], dtype='U')), '+-')
+        try:
+            surge[col_to] = raw.astype(np.float64)
+        except (ValueError, TypeError):
+            logger.debug("⚠️ 거래량 급증 '{}' 필드에 숫자가 아닌 값 포함 -> 해당 종목 제외", col_from)
+            surge[col_to] = pd.to_numeric(pd.Series(raw), errors='coerce').to_numpy(dtype=np.float64)
+    return surge
+
 def update_ohlcv_with_candle(df: Optional[pd.DataFrame], candle: Dict[str, Any]) -> pd.DataFrame:
     """
     실시간 틱 데이터로 완성된 1분봉 캔들(dict)을
@@ -50,33 +93,29 @@ def update_ohlcv_with_candle(df: Optional[pd.DataFrame], candle: Dict[str, Any])
         # 캔들 시간(datetime 객체)을 DataFrame 인덱스로 사용
         candle_time = candle['time']
 
-        # 새 캔들 데이터를 DataFrame 형식으로 변환
-        new_row = pd.DataFrame(
-            [{
-                'open': candle['open'],
-                'high': candle['high'],
-                'low': candle['low'],
-                'close': candle['close'],
-                'volume': candle['volume']
-            }],
-            index=[candle_time] # 인덱스로 캔들 시간 설정
-        )
+        row_values = [candle['open'], candle['high'], candle['low'], candle['close'], candle['volume']]
+
+        # --- 중복 방지 및 업데이트 ---
+        if df is not None and not df.empty and candle_time in df.index:
+            # 만약 이미 해당 시간의 데이터가 있다면, 임시 DataFrame 없이 해당 행만 덮어쓰기
+            df.loc[candle_time, OHLCV_COLUMNS] = row_values
+            return df
+
+        # 새 캔들 데이터를 DataFrame 형식으로 변환 (추가가 필요한 경우에만 생성)
+        new_row = pd.DataFrame([row_values], columns=OHLCV_COLUMNS, index=[candle_time]) # 인덱스로 캔들 시간 설정
         new_row.index.name = 'datetime'
 
         if df is None or df.empty:
             # 기존 DataFrame이 없으면 새 DataFrame 반환
             return new_row
 
-        # --- 중복 방지 및 업데이트 ---
-        if candle_time in df.index:
-            # 만약 이미 해당 시간의 데이터가 있다면, 덮어쓰기
-            df.loc[candle_time] = new_row.iloc[0]
-            return df
-        else:
-            # DataFrame에 새 캔들 추가 (concat 사용)
-            df = pd.concat([df, new_row])
-            return df
+        # 기존 컬럼 타입(float32 가격 등)에 맞춰야 concat 시 전체 컬럼이 float64로 승격되지 않음
+        new_row = new_row.astype(df.dtypes[OHLCV_COLUMNS].to_dict())
+
+        # DataFrame에 새 캔들 추가 (concat 사용)
+        df = pd.concat([df, new_row])
+        return df
 
     except Exception as e:
-        print(f"🚨 [update_ohlcv_with_candle] 캔들 추가 오류: {e}, 캔들: {candle}")
+        logger.error("🚨 [update_ohlcv_with_candle] 캔들 추가 오류: {}, 캔들: {}", e, candle)
         return df if df is not None else pd.DataFrame() # 오류 발생 시 원본 반환
\ No newline at end of file
@@ -1,16 +1,94 @@
 # kiwoom_api.py
 import httpx
 import asyncio
-import json
+import certifi
 import os
+import re
 import ssl
+import time
+import orjson
 import websockets
-import traceback
-from typing import Optional, Dict, List, Callable
-from datetime import datetime, timedelta
+from websockets.asyncio.client import ClientConnection, connect as ws_connect
+from collections import OrderedDict, defaultdict, deque
+from types import MappingProxyType
+from loguru import logger
+from typing import Optional, Dict, List, Set, Callable, Awaitable, Union
+from datetime import datetime
 
 from config.loader import config
 
+# 웹소켓용 SSL 컨텍스트 - 재연결마다 새로 만들지 않고 공유 (같은 컨텍스트를 써야 TLS 세션 재사용도 가능)
+# REST(httpx)와 같은 certifi CA 번들로 서버 인증서/호스트명을 검증
+_WS_SSL_CONTEXT = ssl.create_default_context(cafile=certifi.where())
+
+# 거래량 급증 랭킹(ka10023) 기본 요청 파라미터 (읽기 전용)
+_VOLUME_SURGE_DEFAULTS = MappingProxyType({
+    'mrkt_tp': '000', 'sort_tp': '2', 'tm_tp': '1', 'tm': '5',
+    'trde_qty_tp': '10', 'stk_cnd': '14', 'pric_tp': '8', 'stex_tp': '3'
+})
+
+# 계좌 관련 실시간 TR('00' 주문체결, '04' 잔고)은 종목코드 없이 item [""]으로 등록 - 항상 같은 형태이므로 미리 생성
+_ACCOUNT_TR_ENTRIES = {
+    '00': {"item": [""], "type": ["00"]},
+    '04': {"item": [""], "type": ["04"]},
+}
+# 연결 직후 항상 같은 내용으로 보내는 계좌 TR 등록 패킷 (그룹 1) - 미리 직렬화
+_ACCOUNT_REG_PACKET = orjson.dumps({'trnm': 'REG', 'grp_no': '1', 'refresh': '1', 'data': list(_ACCOUNT_TR_ENTRIES.values())})
+
+class _AIMDTransport(httpx.AsyncBaseTransport):
+    """
+    동시 요청 수를 AIMD(가산 증가 / 승산 감소) 방식으로 조절하는 httpx transport 래퍼.
+    정상 응답마다 허용 동시 요청 수를 조금씩 늘리고, 429/5xx/네트워크 오류 시 절반으로 줄여
+    서버가 버거워할 때 요청이 한꺼번에 몰리지 않도록 합니다.
+    """
+    INITIAL_LIMIT = 8
+    MIN_LIMIT = 2
+    MAX_LIMIT = 64
+    INCREASE = 0.5 # 허용치 1 라운드(limit개 응답)마다 약 +0.5
+    DECREASE = 0.5 # 혼잡 신호 시 허용치 x0.5
+    BACKOFF_STATUS = (429, 502, 503)
+    SLOW_FACTOR = 2.0 # 최근 평균 지연의 2배를 넘으면 증가하지 않음
+
+    def __init__(self, transport: httpx.AsyncBaseTransport):
+        self._transport = transport
+        self.limit = float(self.INITIAL_LIMIT)
+        self._in_flight = 0
+        self._slot_freed = asyncio.Event()
+        self._latencies: deque = deque(maxlen=32) # 최근 응답 지연(초)
+
+    async def handle_async_request(self, request: httpx.Request) -> httpx.Response:
+        # 이벤트 루프 단일 스레드이므로 확인과 증가 사이에 await가 없으면 경쟁 없음
+        while self._in_flight >= int(self.limit):
+            self._slot_freed.clear()
+            await self._slot_freed.wait()
+        self._in_flight += 1
+        start = time.monotonic()
+        congested = True # 네트워크 오류/타임아웃도 혼잡 신호로 취급
+        try:
+            response = await self._transport.handle_async_request(request)
+            congested = response.status_code in self.BACKOFF_STATUS
+            return response
+        except asyncio.CancelledError:
+            congested = False # 호출 측 취소는 서버 상태와 무관
+            raise
+        finally:
+            self._release(time.monotonic() - start, congested)
+
+    def _release(self, latency: float, congested: bool):
+        self._in_flight -= 1
+        if congested:
+            self.limit = max(self.MIN_LIMIT, self.limit * self.DECREASE)
+        else:
+            avg = sum(self._latencies) / len(self._latencies) if self._latencies else latency
+            if latency <= avg * self.SLOW_FACTOR:
+                self.limit = min(self.MAX_LIMIT, self.limit + self.INCREASE / self.limit)
+            self._latencies.append(latency)
+        self._slot_freed.set()
+
+    async def aclose(self):
+        await self._transport.aclose()
+
+
 class KiwoomAPI:
     """키움증권 REST API 및 WebSocket API와의 비동기 통신을 담당합니다."""
 
@@ -19,40 +97,159 @@ class KiwoomAPI:
     REALTIME_URI_PROD = "wss://api.kiwoom.com:10000/api/dostk/websocket"
     BASE_URL_MOCK = "https://mockapi.kiwoom.com"
     REALTIME_URI_MOCK = "wss://mockapi.kiwoom.com:10000/api/dostk/websocket"
+    # REST 경로 (클라이언트 base_url 기준 상대 경로)
+    URL_TOKEN = "/oauth2/token"
+    URL_STKINFO = "/api/dostk/stkinfo"
+    URL_CHART = "/api/dostk/chart"
+    URL_RKINFO = "/api/dostk/rkinfo"
+    URL_ORDR = "/api/dostk/ordr"
+    URL_ACNT = "/api/dostk/acnt"
+    URL_MRKCOND = "/api/dostk/mrkcond"
+    # 조회 TR 응답 캐시 유효 시간 (초) - 종목 정보는 장중에 거의 변하지 않고, 호가는 같은 틱 안의 중복 조회만 흡수
+    TR_CACHE_TTL = {'ka10001': 30.0, 'ka10004': 0.5, 'kt00001': 0.5}
+    TR_CACHE_MAX = 4096 # 조회 TR 캐시 최대 항목 수 (초과 시 가장 오래 조회되지 않은 항목부터 제거)
+    FAN_OUT_CONCURRENCY = 20 # gather_bounded 동시 요청 수 (키움 IP당 요청 한도 고려)
+    # TR 종류별 요청 한도 (RATE_LIMIT_WINDOW초당 최대 요청 수) - 키움 API 이용 제한에 맞춰 조정
+    RATE_LIMIT_WINDOW = 1.0
+    RATE_LIMITS = {'ka': 5, 'kt': 5}
+    # REST 타임아웃 (초) - 응답이 멈춘 요청이 연결/동시 실행 슬롯을 오래 붙잡지 않도록 단계별로 짧게 설정
+    REST_TIMEOUT = httpx.Timeout(connect=2.0, read=8.0, write=4.0, pool=5.0)
+    ORDERBOOK_TIMEOUT = httpx.Timeout(connect=2.0, read=3.0, write=4.0, pool=5.0) # 호가는 늦게 받으면 의미 없음
+    CHART_TIMEOUT = httpx.Timeout(connect=2.0, read=15.0, write=4.0, pool=5.0) # 분봉 응답은 크기가 커서 읽기 여유
+    STOCK_DETAILS_CHUNK = 30 # fetch_multiple_stock_details 요청 1건당 최대 종목 수 (요청 크기 제한 대비)
+    WS_EVENT_QUEUE_MAX = 1024 # 수신 루프와 message_handler 사이 실시간 이벤트 대기열 크기
+    WS_CONFLATE_TYPES = frozenset({'0D'}) # 대기열이 차면 종목별 최신 값만 남겨도 되는 실시간 타입 (호가)
+    SUBSCRIPTION_FLUSH_DELAY = 0.1 # 실시간 등록/해지 요청을 모아서 보내는 대기 시간 (초)
+    # 매수/매도 주문 body 템플릿 (매 주문마다 dict 생성 + JSON 인코딩을 하지 않도록 미리 직렬화된 형태 사용)
+    ORDER_BODY_TEMPLATE = '{"dmst_stex_tp":"KRX","stk_cd":"%s","ord_qty":"%d","ord_uv":"%s","trde_tp":"%s","cond_uv":""}'
+    CANCEL_BODY_TEMPLATE = '{"dmst_stex_tp":"KRX","orig_ord_no":"%s","stk_cd":"%s","cncl_qty":"%d"}' # 취소 수량 0 = 잔량 전부 취소
+    ACCOUNT_BALANCE_BODY = b'{"qry_tp":"2"}' # 예수금 조회 body는 항상 동일하므로 직렬화된 bytes 그대로 사용
+    # 템플릿에 그대로 삽입되므로 종목코드/주문번호는 영문/숫자(+ '_NX' 등 접미사)만 허용
+    STOCK_CODE_PATTERN = re.compile(r'[0-9A-Za-z_]{1,12}')
 
     def __init__(self):
         self.is_mock = config.is_mock
         if self.is_mock:
-            print("🚀 모의투자 환경으로 설정합니다.")
+            self.add_log("🚀 모의투자 환경으로 설정합니다.")
             self.base_url = self.BASE_URL_MOCK
             self.realtime_uri = self.REALTIME_URI_MOCK
             self.app_key = config.kiwoom.mock_app_key
             self.app_secret = config.kiwoom.mock_app_secret
             self.account_no = config.kiwoom.mock_account_no
         else:
-            print("💰 실전투자 환경으로 설정합니다.")
+            self.add_log("💰 실전투자 환경으로 설정합니다.")
             self.base_url = self.BASE_URL_PROD
             self.realtime_uri = self.REALTIME_URI_PROD
             self.app_key = config.kiwoom.app_key
             self.app_secret = config.kiwoom.app_secret
             self.account_no = config.kiwoom.account_no
+        # 계좌번호는 실행 중 바뀌지 않으므로 (앞 8자리, 상품코드) 분리 결과를 한 번만 계산
+        self._account_parts: Optional[tuple[str, str]] = self._parse_account_no()
 
         self._access_token: Optional[str] = None
+        self._token_deadline: Optional[float] = None # 토큰 갱신 필요 시각 (time.monotonic 기준)
         self._token_expires_at: Optional[datetime] = None
-        self.client = httpx.AsyncClient(timeout=None)
-        self.websocket: Optional[websockets.WebSocketClientProtocol] = None
+        self._token_lock = asyncio.Lock() # 토큰 발급 single-flight
+        self._base_headers: Optional[Dict[str, str]] = None # 토큰별 공통 REST 헤더 캐시
+        self._base_order_headers: Optional[Dict[str, str]] = None # 토큰별 주문/계좌 REST 헤더 캐시 (custtype 포함)
+        self._base_headers_token: Optional[str] = None # _base_headers를 만든 토큰
+        self._header_cache: Dict[tuple, Dict[str, str]] = {} # {(tr_id, 주문 여부): 완성된 헤더} - 토큰 변경 시 초기화
+        self.client = self._create_http_client()
+        self.websocket: Optional[ClientConnection] = None
         self.message_handler: Optional[Callable[[Dict], None]] = None
+        self._ws_open: bool = False # LOGIN 완료 ~ 수신 루프 종료/연결 해제 사이에만 True
+        self._ws_send_lock = asyncio.Lock() # PONG 응답과 REG/REMOVE 전송이 섞이지 않도록 송신 직렬화
+        # 실시간 구독 변경 대기열 {grp_no: {type: {item, ...}}}
+        self._pending_reg: Dict[str, Dict[str, Set[str]]] = {}
+        self._pending_remove: Dict[str, Dict[str, Set[str]]] = {}
+        self._subscription_flush_handle: Optional[asyncio.TimerHandle] = None
+        self._subscription_flush_task: Optional[asyncio.Task] = None
+        self._fan_out_semaphore = asyncio.Semaphore(self.FAN_OUT_CONCURRENCY)
+        # 요청 속도 제한 상태 {TR 종류: 최근 요청 시각(loop.time) 목록}, 429 응답에 따른 전체 대기 종료 시각
+        self._rate_windows: Dict[str, deque] = defaultdict(deque)
+        self._throttle_until: float = 0.0
+        # 조회 TR 캐시 {(tr_id, 종목코드): (저장 시각(monotonic), 응답)} - LRU 순서 유지
+        self._tr_cache: OrderedDict = OrderedDict()
+        # 같은 키의 동시 조회를 1회 요청으로 합치기 위한 키별 Lock
+        self._inflight: Dict[tuple, asyncio.Lock] = {}
+        # 실시간 이벤트 대기열: 수신 루프는 넣기만 하고 별도 태스크(_dispatch_events)가 message_handler 호출
+        self._event_q: asyncio.Queue = asyncio.Queue(maxsize=self.WS_EVENT_QUEUE_MAX)
+        self._event_task: Optional[asyncio.Task] = None
+        self._recv_task: Optional[asyncio.Task] = None # 웹소켓 수신 루프 태스크 (연결 해제 시 취소 후 종료 대기)
+        # 대기열 포화 중 보류된 WS_CONFLATE_TYPES 이벤트 {(type, 종목코드): 최신 항목} 및 보류 횟수
+        self._conflated_events: Dict[tuple, Dict] = {}
+        self._conflated_count: int = 0
+        # 수신 메시지 trnm별 처리 함수 (REAL이 대부분이므로 if/elif 대신 dict 조회 1회로 분기)
+        self._ws_dispatch: Dict[str, Callable[[Dict], Awaitable[None]]] = {
+            'REAL': self._handle_real,
+            'REG': self._handle_reg_remove,
+            'REMOVE': self._handle_reg_remove,
+            'SYSTEM': self._handle_system,
+            'LOGIN': self._handle_ignored,
+            'PONG': self._handle_ignored,
+        }
         self._load_token_from_file()
 
-    def add_log(self, message: str):
-        print(f"[{datetime.now().strftime('%H:%M:%S')}][API] {message}")
+    def _create_http_client(self) -> httpx.AsyncClient:
+        """
+        REST 호출용 HTTP 클라이언트 생성.
+        모든 요청이 같은 호스트로 가므로 HTTP/2로 하나의 TLS 연결에 다중화하고, 유휴 연결을 길게 유지합니다.
+        base_url과 고정 헤더(Content-Type, appkey, appsecret)는 클라이언트 기본값으로 설정합니다.
+        """
+        transport = _AIMDTransport(httpx.AsyncHTTPTransport(
+            http2=True,
+            limits=httpx.Limits(max_keepalive_connections=8, max_connections=16, keepalive_expiry=60.0),
+        ))
+        return httpx.AsyncClient(
+            base_url=self.base_url, # 각 메서드는 경로(url_path)만 전달
+            transport=transport, # HTTP/2, 연결 풀 설정은 내부 transport에 지정
+            timeout=self.REST_TIMEOUT,
+            headers={
+                "Content-Type": "application/json;charset=UTF-8",
+                "appkey": self.app_key,
+                "appsecret": self.app_secret,
+            },
+            event_hooks={'response': [self._on_http_response]},
+        )
+
+    async def _on_http_response(self, response: httpx.Response):
+        """(httpx 응답 훅) 429 응답 시 Retry-After 동안 이후 모든 REST 요청을 대기시킴"""
+        if response.status_code != 429: return
+        try: retry_after = float(response.headers.get('retry-after', self.RATE_LIMIT_WINDOW))
+        except ValueError: retry_after = self.RATE_LIMIT_WINDOW
+        self._throttle_until = max(self._throttle_until, asyncio.get_running_loop().time() + retry_after)
+        self.add_log(f"⚠️ 요청 한도 초과(429): {retry_after:.1f}초 동안 REST 요청 대기 ({response.request.headers.get('api-id')})", "WARNING")
+
+    async def _wait_if_throttled(self, tr_id: str):
+        """
+        TR 종류별(ka: 조회, kt: 주문/계좌) 슬라이딩 윈도우 요청 제한.
+        RATE_LIMIT_WINDOW 동안 RATE_LIMITS 개수를 넘으면 가장 오래된 요청이 윈도우를 벗어날 때까지 대기합니다.
+        """
+        loop = asyncio.get_running_loop()
+        now = loop.time()
+        if self._throttle_until > now: # 서버가 429로 대기를 요구한 경우
+            await asyncio.sleep(self._throttle_until - now)
+        bucket = tr_id[:2]
+        limit = self.RATE_LIMITS.get(bucket)
+        if not limit: return
+        window = self._rate_windows[bucket]
+        while True:
+            now = loop.time()
+            while window and now - window[0] >= self.RATE_LIMIT_WINDOW: window.popleft()
+            if len(window) < limit:
+                window.append(now); return
+            await asyncio.sleep(self.RATE_LIMIT_WINDOW - (now - window[0]))
+
+    def add_log(self, message: str, level: str = "INFO"):
+        # loguru가 레벨 필터링과 시각 포맷을 처리 (비활성 레벨의 메시지는 출력 처리 없이 반환)
+        logger.log(level.upper(), f"[API] {message}")
 
     # --- 토큰 관리 (기존 코드 유지) ---
     def _load_token_from_file(self):
         if os.path.exists(self.TOKEN_FILE):
             try:
-                with open(self.TOKEN_FILE, 'r') as f:
-                    token_data = json.load(f)
+                with open(self.TOKEN_FILE, 'rb') as f:
+                    token_data = orjson.loads(f.read())
                 self._access_token = token_data.get('access_token')
                 expires_str = token_data.get('expires_at')
                 if expires_str:
@@ -64,33 +261,58 @@ class KiwoomAPI:
                         self._access_token = None; self._token_expires_at = None
                 else:
                     self.add_log("⚠️ 토큰 파일에 만료 정보 없음."); self._access_token = None; self._token_expires_at = None
-            except (json.JSONDecodeError, KeyError, ValueError, OSError) as e:
+            except (orjson.JSONDecodeError, KeyError, ValueError, OSError) as e:
                 self.add_log(f"⚠️ 토큰 파일 로드 오류: {e}."); self._access_token = None; self._token_expires_at = None
         else:
             self.add_log(f"ℹ️ 토큰 파일({self.TOKEN_FILE}) 없음."); self._access_token = None; self._token_expires_at = None
 
-    def _save_token_to_file(self):
+    def _write_token_file(self, token_data: Dict[str, str]):
+        # 임시 파일에 단일 write로 기록한 뒤 이름 변경 - 쓰는 도중 종료되어도 기존 토큰 파일이 깨지지 않음
+        tmp_path = self.TOKEN_FILE + ".tmp"
+        with open(tmp_path, 'wb') as f: f.write(orjson.dumps(token_data))
+        os.replace(tmp_path, self.TOKEN_FILE)
+
+    async def _save_token_to_file(self):
+        """토큰 파일 저장 (파일 I/O가 이벤트 루프의 틱/PING 처리를 막지 않도록 워커 스레드에서 수행)"""
         if self._access_token and self._token_expires_at:
             token_data = {'access_token': self._access_token, 'expires_at': self._token_expires_at.isoformat()}
             try:
-                with open(self.TOKEN_FILE, 'w') as f: json.dump(token_data, f)
+                await asyncio.to_thread(self._write_token_file, token_data)
                 self.add_log(f"💾 새 토큰 저장 완료 (만료: {self._token_expires_at})")
             except IOError as e: self.add_log(f"❌ 토큰 파일 저장 실패: {e}")
 
+    @property
+    def _token_expires_at(self) -> Optional[datetime]:
+        return self.__token_expires_at
+
+    @_token_expires_at.setter
+    def _token_expires_at(self, expires_at: Optional[datetime]):
+        # 만료 시각이 바뀔 때 한 번만 단조 시계 기준 마감 시각(만료 1분 전)으로 변환해 두고,
+        # 매 요청의 is_token_valid에서는 datetime 생성 없이 float 비교만 수행
+        self.__token_expires_at = expires_at
+        if expires_at is None: self._token_deadline = None
+        else: self._token_deadline = time.monotonic() + (expires_at - datetime.now()).total_seconds() - 60
+
     def is_token_valid(self) -> bool:
-        if not self._access_token or not self._token_expires_at: return False
-        return datetime.now() + timedelta(minutes=1) < self._token_expires_at
+        if not self._access_token or self._token_deadline is None: return False
+        return time.monotonic() < self._token_deadline
 
     async def get_access_token(self) -> Optional[str]:
         if self.is_token_valid(): return self._access_token
+        # 만료 시점에 여러 요청이 동시에 들어와도 토큰 발급은 1회만 수행 (나머지는 대기 후 새 토큰 사용)
+        async with self._token_lock:
+            if self.is_token_valid(): return self._access_token
+            return await self._issue_access_token()
+
+    async def _issue_access_token(self) -> Optional[str]:
         self.add_log("ℹ️ 접근 토큰 신규 발급/갱신 시도...")
-        url = f"{self.base_url}/oauth2/token"
+        url = self.URL_TOKEN
         headers = {"Content-Type": "application/json;charset=UTF-8"}
         body = {"grant_type": "client_credentials", "appkey": self.app_key, "secretkey": self.app_secret}
         try:
-            if self.client.is_closed: self.client = httpx.AsyncClient(timeout=None)
-            res = await self.client.post(url, headers=headers, json=body)
-            res.raise_for_status(); data = res.json()
+            if self.client.is_closed: self.client = self._create_http_client()
+            res = await self.client.post(url, headers=headers, content=orjson.dumps(body))
+            res.raise_for_status(); data = orjson.loads(res.content)
             access_token = data.get("access_token") or data.get("token")
             expires_dt_str = data.get("expires_dt")
             if access_token and expires_dt_str:
@@ -98,15 +320,15 @@ class KiwoomAPI:
                 try: self._token_expires_at = datetime.strptime(expires_dt_str, "%Y%m%d%H%M%S")
                 except ValueError: self.add_log(f"❌ 만료 시간 형식 오류: {expires_dt_str}"); return None
                 self.add_log(f"✅ 접근 토큰 발급/갱신 성공 (만료: {self._token_expires_at})")
-                self._save_token_to_file(); return self._access_token
+                await self._save_token_to_file(); return self._access_token
             else:
                 error_msg = data.get('error_description') or data.get('return_msg') or data.get('msg1', '알 수 없는 오류')
                 self.add_log(f"❌ 토큰 발급 응답 오류: {error_msg} | 응답: {data}")
                 self._access_token = None; self._token_expires_at = None; return None
         except httpx.HTTPStatusError as e:
             error_text = e.response.text; error_msg = error_text
-            try: error_data = e.response.json(); error_msg = error_data.get('error_description') or error_data.get('return_msg') or error_data.get('msg1', error_text)
-            except: pass
+            try: error_data = orjson.loads(e.response.content); error_msg = error_data.get('error_description') or error_data.get('return_msg') or error_data.get('msg1', error_text)
+            except (orjson.JSONDecodeError, AttributeError): pass # 본문이 JSON 객체가 아니면 원문 사용
             self.add_log(f"❌ 접근 토큰 발급 실패 (HTTP {e.response.status_code}): {error_msg}")
             self._access_token = None; self._token_expires_at = None; return None
         except Exception as e:
@@ -114,29 +336,37 @@ class KiwoomAPI:
             self._access_token = None; self._token_expires_at = None; return None
 
     async def _get_headers(self, tr_id: str, is_order: bool = False) -> Optional[Dict]:
-        pure_token = await self.get_access_token()
-        if not pure_token: self.add_log(f"❌ 헤더 생성 실패: 유효 토큰 없음 (tr_id: {tr_id})"); return None
-        access_token_with_bearer = f"Bearer {pure_token}"
-        headers = {
-            "Content-Type": "application/json;charset=UTF-8",
-            "authorization": access_token_with_bearer,
-            "appkey": self.app_key,
-            "appsecret": self.app_secret,
-            "api-id": tr_id,
-        }
+        # 모든 REST 메서드가 요청 직전에 호출하므로 여기서 요청 속도 제한
+        await self._wait_if_throttled(tr_id)
+        # 토큰이 바뀌기 전까지 (tr_id, 주문 여부)별 헤더는 항상 같으므로 완성된 dict를 캐시해서 그대로 반환
+        # (httpx는 전달받은 헤더 dict를 수정하지 않음. Content-Type, appkey, appsecret은 클라이언트 기본 헤더로 자동 포함)
+        if self._base_headers is None or self._base_headers_token != self._access_token or not self.is_token_valid():
+            pure_token = await self.get_access_token()
+            if not pure_token: self.add_log(f"❌ 헤더 생성 실패: 유효 토큰 없음 (tr_id: {tr_id})"); return None
+            self._base_headers = {"authorization": f"Bearer {pure_token}"}
+            self._base_order_headers = {**self._base_headers, "custtype": "P"}
+            self._base_headers_token = pure_token
+            self._header_cache.clear()
+        key = (tr_id, is_order)
+        headers = self._header_cache.get(key)
+        if headers is not None: return headers
         if is_order:
             if not self.account_no: self.add_log("❌ 주문 헤더 생성 실패: 계좌번호 없음."); return None
-            headers["custtype"] = "P"
+            headers = self._base_order_headers.copy()
             # 주문 TR ID를 기반으로 정확한 헤더를 추가해야 할 수 있습니다.
             # 예: 주문 API가 'tr_cont' 헤더를 요구한다면 여기서 추가
             # if tr_id in ["kt10000", "kt10001", "kt10002", "kt10003"]: # 주문 관련 TR ID 목록
             #    headers["tr_cont"] = "N" # 또는 필요한 값
+        else:
+            headers = self._base_headers.copy()
+        headers["api-id"] = tr_id
+        self._header_cache[key] = headers
         return headers
 
     # --- WebSocket 연결 및 관리 ---
     async def connect_websocket(self, handler: Callable[[Dict], None]) -> bool:
         """웹소켓 연결, LOGIN 인증, 실시간 데이터 수신 시작"""
-        if self.websocket and self.websocket.open:
+        if self._ws_open:
             self.add_log("ℹ️ 이미 웹소켓에 연결됨."); return True
 
         pure_token = await self.get_access_token()
@@ -146,39 +376,38 @@ class KiwoomAPI:
         self.message_handler = handler
         self.add_log(f"🛰️ 웹소켓 연결 시도: {self.realtime_uri}")
 
-        ssl_context = ssl.SSLContext(ssl.PROTOCOL_TLS_CLIENT)
-        ssl_context.check_hostname = False
-        ssl_context.verify_mode = ssl.CERT_NONE
-        self.add_log("⚠️ SSL 인증서 검증을 비활성화합니다. (테스트 목적, 보안 주의!)")
-
         connection_timeout = 60
 
         try:
             # --- 수정: extra_headers 제거, ping_interval=None ---
-            self.websocket = await websockets.connect(
+            self.websocket = await ws_connect(
                 self.realtime_uri,
                 ping_interval=None, # 서버 PING에 라이브러리가 자동 PONG 응답하도록 시도
                 ping_timeout=20,    # PONG 응답 대기 시간은 유지
                 open_timeout=connection_timeout,
-                ssl=ssl_context
+                ssl=_WS_SSL_CONTEXT,
+                compression=None,   # 짧은 JSON 틱 위주라 permessage-deflate는 CPU/메모리만 소모
+                max_size=2**20,     # 수신 메시지 최대 1MiB
+                max_queue=64,       # 처리 지연 시 무한정 쌓이지 않도록 수신 대기열 제한 (배압)
             )
             # --- 수정 끝 ---
-            self.add_log("✅ 웹소켓 연결 성공! (SSL 검증 비활성화)")
+            self.add_log("✅ 웹소켓 연결 성공!")
 
             # LOGIN 처리 (기존과 동일)
             try:
                 login_packet = {'trnm': 'LOGIN', 'token': pure_token}
-                login_request_string = json.dumps(login_packet)
-                self.add_log(f"➡️ WS LOGIN 요청 전송: {json.dumps({'trnm': 'LOGIN', 'token': '...' + pure_token[-10:]})}")
-                await self.websocket.send(login_request_string)
+                self.add_log(f"➡️ WS LOGIN 요청 전송: {{'trnm': 'LOGIN', 'token': '...{pure_token[-10:]}'}}")
+                # JSON은 ASCII이므로 str 변환 없이 bytes를 텍스트 프레임으로 전송
+                await self.websocket.send(orjson.dumps(login_packet), text=True)
                 self.add_log("✅ WS LOGIN 요청 전송 완료")
 
                 self.add_log("⏳ WS LOGIN 응답 대기 중...")
                 login_response_str = await asyncio.wait_for(self.websocket.recv(), timeout=10)
                 self.add_log(f"📬 WS LOGIN 응답 수신: {login_response_str}")
-                login_response = json.loads(login_response_str)
+                login_response = orjson.loads(login_response_str)
 
                 if login_response.get('trnm') == 'LOGIN' and login_response.get('return_code') == 0:
+                    self._ws_open = True
                     self.add_log("✅ 웹소켓 LOGIN 성공")
                 else:
                     self.add_log(f"❌ 웹소켓 LOGIN 실패: {login_response}")
@@ -187,507 +416,550 @@ class KiwoomAPI:
             except asyncio.TimeoutError:
                 self.add_log("❌ WS LOGIN 응답 시간 초과 (10초)")
                 await self.disconnect_websocket(); return False
-            except json.JSONDecodeError:
+            except orjson.JSONDecodeError:
                 self.add_log(f"❌ WS LOGIN 응답 파싱 실패: {login_response_str}")
                 await self.disconnect_websocket(); return False
             except Exception as login_e:
-                self.add_log(f"❌ WS LOGIN 처리 중 오류: {login_e}")
-                self.add_log(f" traceback: {traceback.format_exc()}")
+                logger.exception("[API] ❌ WS LOGIN 처리 중 오류: {}", login_e)
                 await self.disconnect_websocket(); return False
 
-            asyncio.create_task(self._receive_messages())
+            if self._event_task is None or self._event_task.done():
+                self._event_task = asyncio.create_task(self._dispatch_events())
+            self._recv_task = asyncio.create_task(self._receive_messages(), name="kiwoom-ws-recv")
             await asyncio.sleep(1)
 
             # '00', '04' TR은 계좌번호를 item(key)으로 사용해야 할 수 있음 (가이드 확인 필요)
             # 일단 가이드 예시처럼 ""를 사용, 문제가 되면 계좌번호로 변경
             if not self.account_no:
               self.add_log("❌ 실시간 TR 등록 실패: 계좌번호 설정 필요"); await self.disconnect_websocket(); return False
-            # ✅ 계좌 관련 TR('00', '04')만 우선 등록
-            await self.register_realtime(tr_ids=['00', '04'], tr_keys=["", ""])
+            # ✅ 계좌 관련 TR('00', '04')만 우선 등록 (내용이 고정이므로 대기열/직렬화 없이 바로 전송)
+            self.add_log("➡️ WS REG 요청 전송: 계좌 TR (00, 04)")
+            await self.send_websocket_request_raw(_ACCOUNT_REG_PACKET)
             return True
 
-        except websockets.exceptions.InvalidStatusCode as e:
-            self.add_log(f"❌ 웹소켓 연결 실패 (상태 코드 {e.status_code}): {e.headers}. 주소/서버 상태 확인.")
+        except websockets.exceptions.InvalidStatus as e:
+            self.add_log(f"❌ 웹소켓 연결 실패 (상태 코드 {e.response.status_code}): {e.response.headers}. 주소/서버 상태 확인.")
         except asyncio.TimeoutError:
             self.add_log(f'❌ 웹소켓 연결 시간 초과 ({connection_timeout}초)')
         except OSError as e:
              self.add_log(f"❌ 웹소켓 연결 OS 오류: {e}")
         except Exception as e:
-            self.add_log(f"❌ 웹소켓 연결 중 예상치 못한 오류: {e}")
-            self.add_log(f" traceback: {traceback.format_exc()}")
+            logger.exception("[API] ❌ 웹소켓 연결 중 예상치 못한 오류: {}", e)
 
-        self.websocket = None
+        self._ws_open = False; self.websocket = None
         return False
 
+    # --- 수신 메시지 trnm별 처리 (_receive_messages에서 self._ws_dispatch로 호출) ---
+    async def _handle_real(self, data: Dict):
+        """
+        REAL: 실시간 항목 dict(type/item/values)를 새로 만들지 않고 그대로 이벤트 대기열에 넣음 (trnm만 주입, item은 정제)
+        대기열이 차면 호가(WS_CONFLATE_TYPES)는 종목별 최신 값만 보류하고, 나머지(체결/주문/잔고)는 자리가 날 때까지
+        수신 루프를 멈춰 서버 쪽으로 배압을 전달 (틱/주문 통보는 누락되면 안 됨)
+        """
+        realtime_data_list = data.get('data')
+        if type(realtime_data_list) is not list:
+            self.add_log(f"⚠️ 'REAL' 메시지 data 필드 오류: {data}", "WARNING"); return
+        if not self.message_handler: return
+        event_q = self._event_q
+        conflated = self._conflated_events
+        for item_data in realtime_data_list:
+            if 'values' not in item_data:
+                self.add_log(f"⚠️ 실시간 데이터 항목 형식 오류 (values 누락): {item_data}", "WARNING")
+                continue
+            item_code_raw = item_data.get('item')
+            if item_code_raw:
+                if item_code_raw[0] == 'A': item_code_raw = item_code_raw[1:]
+                if item_code_raw.endswith(('_NX', '_AL')): item_code_raw = item_code_raw[:-3]
+                item_data['item'] = item_code_raw
+            else:
+                item_data['item'] = None # 주문 체결('00') 등 종목 코드가 없는 경우
+            item_data['trnm'] = 'REAL'
+            if item_data.get('type') in self.WS_CONFLATE_TYPES:
+                key = (item_data['type'], item_data['item'])
+                # 이미 보류 중인 종목은 계속 보류 항목만 갱신해야 오래된 값이 나중에 전달되지 않음
+                if key in conflated or event_q.full():
+                    conflated[key] = item_data; self._conflated_count += 1
+                    continue
+            try: event_q.put_nowait(item_data)
+            except asyncio.QueueFull: await event_q.put(item_data)
+
+    async def _handle_reg_remove(self, data: Dict):
+        """REG/REMOVE 응답: 로그 후 message_handler로 전달"""
+        rt_cd_raw = data.get('return_code')
+        msg = data.get('return_msg', '메시지 없음')
+        self.add_log(f"📬 WS 응답 ({data['trnm']}): code={rt_cd_raw}, msg='{msg}'")
+        # 핸들러가 설정되어 있으면 응답 데이터 전달 (engine.py의 handle_realtime_data가 처리)
+        if self.message_handler:
+            self.message_handler(data) # data 딕셔너리 전체 전달
+
+    async def _handle_system(self, data: Dict):
+        code = data.get("code"); msg = data.get("message")
+        self.add_log(f"ℹ️ WS 시스템 메시지: [{code}] {msg}")
+
+    async def _handle_ignored(self, data: Dict):
+        """LOGIN(연결 시 별도 처리), PONG: 무시"""
+        pass
+
+    async def _dispatch_events(self):
+        """실시간 이벤트 대기열을 비우며 message_handler 호출. 대기열이 비면 보류된 호가(최신 값)를 전달"""
+        event_q = self._event_q
+        while True:
+            events = [await event_q.get()]
+            if event_q.empty() and self._conflated_events:
+                events.extend(self._conflated_events.values()); self._conflated_events.clear()
+                logger.warning("[API] ⚠️ 실시간 이벤트 대기열 포화: 호가 {}건을 종목별 최신 값으로 병합", self._conflated_count)
+                self._conflated_count = 0
+            handler = self.message_handler
+            if not handler: continue
+            for event in events:
+                try: handler(event)
+                except Exception as e: logger.exception("[API] ❌ 실시간 이벤트 처리 중 오류: {}", e)
+
     async def _receive_messages(self):
         """웹소켓 메시지 수신 및 처리 루프"""
-        if not self.websocket or not self.websocket.open:
+        if not self._ws_open:
             self.add_log("⚠️ 메시지 수신 불가: 웹소켓 연결 안됨."); return
         self.add_log("👂 실시간 메시지 수신 대기 중...")
+        # 수신 루프에서 매 메시지마다 반복되는 속성/전역 조회를 지역 변수로 고정
+        dispatch = self._ws_dispatch.get
+        loads = orjson.loads
+        decode_error = orjson.JSONDecodeError
+        ping_prefix = '{"trnm":"PING"'
+        ws = self.websocket
         try:
-            async for message in self.websocket:
+            async for message in ws:
+
+                # 빈 메시지 및 바이너리 프레임 무시 (수신 타입은 str/bytes 뿐이므로 정확한 타입 비교로 충분)
+                if not message or type(message) is bytes: continue
 
-                if isinstance(message, bytes): continue
-                if not isinstance(message, str) or not message.strip(): continue
+                # PING은 JSON 파싱 없이 원문 그대로 응답 (앞부분 문자열 비교만 수행, 형식이 다르면 아래 일반 경로에서 처리)
+                if message.startswith(ping_prefix):
+                    await self.send_websocket_request_raw(message)
+                    continue
 
+                # 메시지 일부는 로거가 실제로 출력할 때만 잘라서 포맷 (인자로 전달)
                 try:
-                    data = json.loads(message)
-                    trnm = data.get("trnm")
-
-                    if trnm == "SYSTEM":
-                        code = data.get("code"); msg = data.get("message")
-                        self.add_log(f"ℹ️ WS 시스템 메시지: [{code}] {msg}")
-                        continue
-                    
-                    # --- 👇 PING 처리 로직 복구 ---
+                    data = loads(message)
+                    trnm = data["trnm"] # 키움 메시지는 항상 trnm을 포함
+                except decode_error:
+                    logger.warning("[API] ⚠️ WS JSON 파싱 실패: {:.100}...", message); continue
+                except (KeyError, TypeError):
+                    logger.warning("[API] ⚠️ WS 메시지에 trnm 없음: {:.100}...", message); continue
+
+                try:
+                    handle = dispatch(trnm)
+                    if handle is not None:
+                        await handle(data)
                     elif trnm == 'PING':
-                        self.add_log(">>> PING 수신. PING을 그대로 응답합니다.")
-                        # 수신한 PING 메시지 문자열을 그대로 다시 보냄
-                        asyncio.create_task(self.send_websocket_request_raw(message))
-                        continue # PING 처리는 여기서 종료
-                    # --- 👆 PING 처리 복구 끝 ---
-
-                    if trnm == 'LOGIN': continue
-
-                    # --- 👇 REG/REMOVE 응답도 message_handler로 전달 ---
-                    if trnm in ['REG', 'REMOVE']:
-                        rt_cd_raw = data.get('return_code')
-                        msg = data.get('return_msg', '메시지 없음')
-                        self.add_log(f"📬 WS 응답 ({trnm}): code={rt_cd_raw}, msg='{msg}'") # 로그 위치 이동 및 내용 확인
-
-                        # 핸들러가 설정되어 있으면 응답 데이터 전달
-                        if self.message_handler:
-                            # engine.py의 handle_realtime_data가 처리할 수 있도록 데이터 전달
-                            self.message_handler(data) # data 딕셔너리 전체 전달
-                        # continue 제거: 아래 REAL 처리 로직과 분리
-
-                    elif trnm == 'REAL':
-                        realtime_data_list = data.get('data')
-                        if isinstance(realtime_data_list, list):
-                            for item_data in realtime_data_list:
-                                data_type = item_data.get('type')
-                                item_code_raw = item_data.get('item', '') # 키움 'item' 사용
-                                values = item_data.get('values')
-
-                                if not data_type or not values:
-                                    self.add_log(f"⚠️ 실시간 데이터 항목 형식 오류 (type/values 누락): {item_data}")
-                                    continue
-
-                                stock_code = None
-                                if item_code_raw:
-                                    stock_code = item_code_raw[1:] if item_code_raw.startswith('A') else item_code_raw
-                                    if stock_code.endswith(('_NX', '_AL')): stock_code = stock_code[:-3]
-
-                                # ✅ '1h' 타입 (VI 발동/해제) 처리 추가
-                                if data_type == '1h':
-                                    if stock_code and self.message_handler:
-                                        # 핸들러에 필요한 정보만 전달
-                                        self.message_handler({
-                                            "trnm": "REAL",
-                                            "type": data_type, # '1h'
-                                            "item": stock_code, # 정제된 종목 코드
-                                            "values": values # values 딕셔너리 전체 전달
-                                        })
-                                    else:
-                                         self.add_log(f"⚠️ VI(1h) 데이터 처리 불가 (코드:{stock_code}, 핸들러:{self.message_handler is not None}): {values}")
-
-                                # --- 기존 다른 타입 처리 ('0B', '0D', '00', '04') ---
-                                elif data_type in ['0B', '0D', '04']: # 잔고(04)도 stock_code 필요
-                                    if stock_code and self.message_handler:
-                                        self.message_handler({
-                                            "trnm": "REAL",
-                                            "type": data_type,
-                                            "item": stock_code,
-                                            "values": values
-                                        })
-                                elif data_type == '00': # 주문 체결은 stock_code 없어도 처리
-                                    if self.message_handler:
-                                         self.message_handler({
-                                            "trnm": "REAL",
-                                            "type": data_type,
-                                            "item": stock_code, # 있어도 전달, 없으면 None 전달
-                                            "values": values
-                                        })
-                                # --- 처리 끝 ---
-
-                        else:
-                            self.add_log(f"⚠️ 'REAL' 메시지 data 필드 오류: {data}")
-
-                    else: # PONG 또는 알 수 없는 trnm
-                        if trnm != 'PONG':
-                             self.add_log(f"ℹ️ 알 수 없는 형식의 WS 메시지 (trnm: {trnm}): {data}")
-
-                except json.JSONDecodeError: self.add_log(f"⚠️ WS JSON 파싱 실패: {message[:100]}...")
+                        # 수신한 PING 메시지 문자열을 그대로 다시 보냄 (송신을 기다려야 하므로 dispatch 테이블 대신 여기서 처리)
+                        self.add_log(">>> PING 수신. PING을 그대로 응답합니다.", "DEBUG")
+                        await self.send_websocket_request_raw(message)
+                    else: # 알 수 없는 trnm
+                        self.add_log(f"ℹ️ 알 수 없는 형식의 WS 메시지 (trnm: {trnm}): {data}")
+
                 except Exception as e:
-                    self.add_log(f"❌ WS 메시지 처리 중 오류: {e} | Msg: {message[:100]}...")
-                    self.add_log(f" traceback: {traceback.format_exc()}")
+                    # 스택 트레이스는 해당 레벨을 받는 sink가 있을 때만 loguru가 포맷
+                    logger.exception("[API] ❌ WS 메시지 처리 중 오류: {} | Msg: {:.100}...", e, message)
 
         except websockets.exceptions.ConnectionClosedOK: self.add_log("ℹ️ 웹소켓 정상 종료.")
         except websockets.exceptions.ConnectionClosedError as e: self.add_log(f"❌ 웹소켓 비정상 종료: {e.code} {e.reason}")
-        except asyncio.CancelledError: self.add_log("ℹ️ 메시지 수신 태스크 취소됨.")
+        except asyncio.CancelledError: self.add_log("ℹ️ 메시지 수신 태스크 취소됨.", "DEBUG")
         except Exception as e: self.add_log(f"❌ WS 수신 루프 오류: {e}")
-        finally: self.add_log("🛑 메시지 수신 루프 종료."); self.websocket = None
-
-    async def send_websocket_request_raw(self, message: str):
-        """JSON 문자열을 웹소켓으로 직접 전송 (LOGIN, REG, REMOVE, PONG 용도)"""
-        if self.websocket and self.websocket.open:
+        finally: self.add_log("🛑 메시지 수신 루프 종료."); self._ws_open = False; self.websocket = None
+
+    async def send_websocket_request_raw(self, message: Union[str, bytes]):
+        """
+        JSON 메시지를 웹소켓으로 직접 전송 (REG, REMOVE, PONG 용도).
+        orjson으로 직렬화한 bytes도 str로 다시 디코딩하지 않고 텍스트 프레임으로 전송합니다. (서버는 텍스트 프레임만 처리)
+        """
+        if self._ws_open:
             try:
-                await self.websocket.send(message)
+                async with self._ws_send_lock:
+                    await self.websocket.send(message, text=True)
             except Exception as e:
                 self.add_log(f"❌ 웹소켓 RAW 메시지 전송 실패: {e}")
         else:
             self.add_log("⚠️ 웹소켓 미연결, RAW 전송 불가.")
 
+    def _add_pending_subscriptions(self, target: Dict[str, Dict[str, Set[str]]], opposite: Dict[str, Dict[str, Set[str]]],
+                                   tr_ids: List[str], tr_keys: List[str], group_no: str):
+        """구독 변경 요청을 대기열(target)에 합치고, 반대 대기열(opposite)의 같은 항목은 취소합니다."""
+        group_target = target.get(group_no)
+        if group_target is None: group_target = target[group_no] = defaultdict(set)
+        group_opposite = opposite.get(group_no)
+        for tr_id, tr_key in zip(tr_ids, tr_keys):
+            # ✅ '00', '04'(계좌 TR)는 item 없이 등록, 그 외('0B', '0D', '1h')는 종목 코드 필요
+            if tr_id in _ACCOUNT_TR_ENTRIES: item = ""
+            elif tr_key: item = tr_key
+            else: continue
+            if group_opposite and tr_id in group_opposite: group_opposite[tr_id].discard(item)
+            group_target[tr_id].add(item)
+
+    def _schedule_subscription_flush(self):
+        """구독 변경 대기열 전송을 SUBSCRIPTION_FLUSH_DELAY 후로 예약 (이미 예약되어 있으면 그대로 둠)"""
+        if self._subscription_flush_handle is None:
+            loop = asyncio.get_running_loop()
+            self._subscription_flush_handle = loop.call_later(self.SUBSCRIPTION_FLUSH_DELAY, self._on_subscription_flush_timer)
+
+    def _on_subscription_flush_timer(self):
+        self._subscription_flush_handle = None
+        self._subscription_flush_task = asyncio.create_task(self.flush_subscriptions())
+
+    @staticmethod
+    def _build_realtime_payload(pending: Dict[str, Set[str]]) -> List[Dict]:
+        """type별로 모인 item으로 REG/REMOVE data 필드를 구성"""
+        # 가이드 예시: data: [{"item": ["005930"], "type": ["0B"]}, {"item": [""], "type": ["00"]}]
+        data_payload = []
+        for tr_id, items in pending.items():
+            if not items: continue
+            account_entry = _ACCOUNT_TR_ENTRIES.get(tr_id)
+            if account_entry is not None:
+                data_payload.append(account_entry); continue
+            # ✅ type은 리스트가 아닌 단일 문자열로 전달 (API 문서 확인 필요, 여러개 동시 구독이 되는지?)
+            # 우선 가이드대로 type을 리스트로 유지
+            data_payload.append({"item": sorted(items), "type": [tr_id]})
+        return data_payload
+
+    async def flush_subscriptions(self):
+        """대기 중인 구독 해지/등록 요청을 그룹별 REMOVE 1건, REG 1건으로 합쳐 즉시 전송"""
+        if self._subscription_flush_handle is not None:
+            self._subscription_flush_handle.cancel(); self._subscription_flush_handle = None
+        pending_remove, self._pending_remove = self._pending_remove, {}
+        pending_reg, self._pending_reg = self._pending_reg, {}
+
+        for group_no, pending in pending_remove.items():
+            data_payload = self._build_realtime_payload(pending)
+            if not data_payload: continue
+            self.add_log(f"➡️ WS REMOVE 요청 전송: grp_no={group_no}, data={data_payload}")
+            await self.send_websocket_request_raw(orjson.dumps({ 'trnm': 'REMOVE', 'grp_no': group_no, 'data': data_payload }))
+
+        for group_no, pending in pending_reg.items():
+            data_payload = self._build_realtime_payload(pending)
+            if not data_payload: continue
+            self.add_log(f"➡️ WS REG 요청 전송: grp_no={group_no}, data={data_payload}")
+            await self.send_websocket_request_raw(orjson.dumps({ 'trnm': 'REG', 'grp_no': group_no, 'refresh': '1', 'data': data_payload }))
+
     async def register_realtime(self, tr_ids: list[str], tr_keys: list[str], group_no: str = "1"):
-        """실시간 데이터 구독 ('REG') 메시지 구성 및 전송 (가이드 형식 준수)"""
+        """
+        실시간 데이터 구독 ('REG') 요청을 대기열에 추가합니다.
+        SUBSCRIPTION_FLUSH_DELAY 동안 들어온 등록/해지 요청을 모아 하나의 REG/REMOVE 메시지로 전송합니다.
+        """
         self.add_log(f"➡️ 실시간 등록 요청 시도: ID(type)={tr_ids}, KEY(item)={tr_keys}")
         if len(tr_ids) != len(tr_keys):
             self.add_log("❌ 실시간 등록 실패: ID(type)와 KEY(item) 개수가 일치하지 않음"); return
 
-        # 가이드 예시: data: [{"item": ["005930"], "type": ["0B"]}, {"item": [""], "type": ["00"]}]
-        data_payload = []
-        grouped_items = {} # type별로 item들을 그룹화
-
-        for tr_id, tr_key in zip(tr_ids, tr_keys):
-            # ✅ '1h'도 item(종목코드)이 필요한 TR로 처리
-            if tr_id in ['00', '04']:
-                data_payload.append({"item": [""], "type": [tr_id]})
-            else: # '0B', '0D', '1h' 등 종목 코드가 필요한 경우
-                if tr_id not in grouped_items:
-                    grouped_items[tr_id] = []
-                if tr_key:
-                    grouped_items[tr_id].append(tr_key)
-
-        for tr_id, items in grouped_items.items():
-            if items:
-                # ✅ type은 리스트가 아닌 단일 문자열로 전달 (API 문서 확인 필요, 여러개 동시 구독이 되는지?)
-                # 우선 가이드대로 type을 리스트로 유지
-                data_payload.append({"item": items, "type": [tr_id]})
-
-        if not data_payload:
-            self.add_log("⚠️ 실시간 등록 요청할 유효한 데이터 없음.")
-            return
-
-        request_message = { 'trnm': 'REG', 'grp_no': group_no, 'refresh': '1', 'data': data_payload }
-        request_string = json.dumps(request_message)
-        self.add_log(f"➡️ WS REG 요청 전송: {request_string}")
-        await self.send_websocket_request_raw(request_string)
+        self._add_pending_subscriptions(self._pending_reg, self._pending_remove, tr_ids, tr_keys, group_no)
+        self._schedule_subscription_flush()
 
     async def unregister_realtime(self, tr_ids: List[str], tr_keys: List[str], group_no: str = "1"):
-        """실시간 데이터 구독 해지 ('REMOVE') 메시지 구성 및 전송 (register_realtime과 동일한 로직 적용)"""
+        """실시간 데이터 구독 해지 ('REMOVE') 요청을 대기열에 추가합니다. (register_realtime과 동일하게 묶어서 전송)"""
         self.add_log(f"➡️ 실시간 해지 요청 시도: ID(type)={tr_ids}, KEY(item)={tr_keys}")
         if len(tr_ids) != len(tr_keys):
             self.add_log("❌ 실시간 해지 실패: ID(type)와 KEY(item) 개수가 일치하지 않음"); return
 
-        # register_realtime과 동일한 data payload 구성 로직 사용
-        data_payload = []
-        grouped_items = {}
-        for tr_id, tr_key in zip(tr_ids, tr_keys):
-            if tr_id in ['00', '04']: data_payload.append({"item": [""], "type": [tr_id]})
-            else: # ✅ '1h' 포함
-                if tr_id not in grouped_items: grouped_items[tr_id] = []
-                if tr_key: grouped_items[tr_id].append(tr_key)
-        for tr_id, items in grouped_items.items():
-            if items: data_payload.append({"item": items, "type": [tr_id]}) # ✅ type 리스트 유지
-
-        if not data_payload: self.add_log("⚠️ 실시간 해지 요청할 유효한 데이터 없음."); return
-
-        request_message = { 'trnm': 'REMOVE', 'grp_no': group_no, 'data': data_payload }
-        request_string = json.dumps(request_message)
-        self.add_log(f"➡️ WS REMOVE 요청 전송: {request_string}")
-        await self.send_websocket_request_raw(request_string)
+        self._add_pending_subscriptions(self._pending_remove, self._pending_reg, tr_ids, tr_keys, group_no)
+        self._schedule_subscription_flush()
 
     async def disconnect_websocket(self):
-        if self.websocket and self.websocket.open:
+        # 대기 중인 등록(REG)은 재연결 시 다시 등록되므로 폐기하고,
+        # 대기 중인 해지(REMOVE)는 소켓이 아직 열려 있으면 닫기 전에 바로 전송 (종료 시 구독 해지가 서버에 전달되도록)
+        self._pending_reg.clear()
+        if self._ws_open and self._pending_remove:
+            await self.flush_subscriptions()
+        if self._subscription_flush_handle is not None:
+            self._subscription_flush_handle.cancel(); self._subscription_flush_handle = None
+        self._pending_remove.clear()
+        self._ws_open = False
+        # 수신 루프는 종료 시 self.websocket을 비우므로 닫을 소켓을 먼저 잡아 둠
+        ws = self.websocket
+        # 소켓을 닫기 전에 수신 루프를 먼저 취소하고 끝날 때까지 대기 (종료 시 pending 태스크가 남지 않도록)
+        recv_task = self._recv_task; self._recv_task = None
+        if recv_task is not None and not recv_task.done() and recv_task is not asyncio.current_task():
+            recv_task.cancel()
+            try: await recv_task
+            except asyncio.CancelledError: pass
+        # LOGIN 실패 등으로 _ws_open이 False여도 소켓 자체는 열려 있을 수 있으므로 객체 존재 여부로 판단
+        if ws:
             self.add_log("🔌 웹소켓 연결 종료 시도...")
-            try: await self.websocket.close()
+            try: await ws.close()
             except Exception as e: self.add_log(f"⚠️ 웹소켓 종료 중 오류: {e}")
             finally: self.websocket = None; self.add_log("🔌 웹소켓 연결 종료 완료.")
 
     async def close(self):
         await self.disconnect_websocket()
+        if self._event_task is not None:
+            self._event_task.cancel(); self._event_task = None
         if self.client and not self.client.is_closed:
             try: await self.client.aclose(); self.add_log("🔌 HTTP 클라이언트 세션 종료")
             except Exception as e: self.add_log(f"⚠️ HTTP 클라이언트 종료 중 오류: {e}")
 
+    async def __aenter__(self) -> "KiwoomAPI":
+        return self
+
+    async def __aexit__(self, exc_type, exc, tb):
+        await self.close() # 예외로 빠져나와도 웹소켓/HTTP 연결 정리
+
     # --- REST API 메서드들 (이전 코드 유지) ---
+    def _get_cached_tr(self, key: tuple) -> Optional[Dict]:
+        """TTL 안의 캐시 응답 반환 (없거나 만료되면 None)"""
+        cached = self._tr_cache.get(key)
+        if cached is None: return None
+        if time.monotonic() - cached[0] >= self.TR_CACHE_TTL[key[0]]:
+            del self._tr_cache[key]; return None
+        self._tr_cache.move_to_end(key)
+        return cached[1]
+
+    async def _cached_tr(self, tr_id: str, stock_code: str, fetcher: Callable[[], Awaitable[Optional[Dict]]]) -> Optional[Dict]:
+        """
+        조회 TR 결과를 TR_CACHE_TTL 동안 캐시. 같은 키로 동시에 들어온 조회는 키별 Lock으로 묶어
+        첫 요청의 결과를 나머지가 캐시에서 받도록 함 (실패(None 또는 return_code가 0이 아닌 응답)는 캐시하지 않음)
+        """
+        key = (tr_id, stock_code)
+        cached = self._get_cached_tr(key)
+        if cached is not None: return cached
+        lock = self._inflight.setdefault(key, asyncio.Lock())
+        try:
+            async with lock:
+                cached = self._get_cached_tr(key)
+                if cached is not None: return cached
+                result = await fetcher()
+                if result is not None and result.get('return_code', 0) == 0:
+                    self._tr_cache[key] = (time.monotonic(), result)
+                    self._tr_cache.move_to_end(key)
+                    while len(self._tr_cache) > self.TR_CACHE_MAX:
+                        self._tr_cache.popitem(last=False)
+                return result
+        finally:
+            if not lock.locked() and self._inflight.get(key) is lock:
+                del self._inflight[key]
+
     async def fetch_stock_info(self, stock_code: str) -> Optional[Dict]:
-        url = "/api/dostk/stkinfo"; tr_id = "ka10001"
-        headers = await self._get_headers(tr_id)
-        if not headers: return None
-        body = {"stk_cd": stock_code}
+        """주식 기본 정보 조회 (ka10001). 장중에 거의 변하지 않으므로 TR_CACHE_TTL 동안 캐시된 output을 반환"""
+        return await self._cached_tr("ka10001", stock_code, lambda: self._request_stock_info(stock_code))
+
+    @staticmethod
+    def _parse_rc(data: Dict) -> tuple[int, str]:
+        """
+        응답의 (return_code, return_msg) 반환. return_code는 TR에 따라 0 또는 '0'으로 오므로 int로 한 번만 정규화하고
+        응답 dict에도 다시 기록해 호출 측(엔진)은 == 0 비교만 하면 되도록 함 (없거나 숫자가 아니면 -1)
+        """
+        try: return_code = int(data.get('return_code'))
+        except (TypeError, ValueError): return_code = -1
+        data['return_code'] = return_code
+        return return_code, data.get('return_msg', '')
+
+    async def _post(self, tr_id: str, url_path: str, body: Union[Dict, str, bytes], is_order: bool = False,
+                    context: str = "", timeout: Optional[httpx.Timeout] = None) -> tuple[Optional[Dict], Optional[Dict]]:
+        """
+        REST 요청 공통 처리 (헤더 생성 → POST → JSON 파싱)
+        Returns: (응답 dict, None) 또는 실패 시 (None, {'return_code', 'return_msg'}) - 실패 로그는 여기서 남김
+        (return_code: 헤더 생성 실패/네트워크 오류 -1, HTTP 오류는 상태코드, 예상치 못한 오류 -99)
+        응답의 return_code 검증은 TR마다 성공 조건이 달라 호출 측에서 수행
+        timeout을 지정하지 않으면 클라이언트 기본값(REST_TIMEOUT) 사용
+        """
+        headers = await self._get_headers(tr_id, is_order=is_order)
+        if not headers:
+            self.add_log(f"❌ [API {tr_id}] ({context}) 헤더 생성 실패.", "ERROR")
+            return None, {'return_code': -1, 'return_msg': '헤더 생성 실패'}
+        if isinstance(body, dict): body = orjson.dumps(body)
+        elif isinstance(body, str): body = body.encode()
         try:
-            res = await self.client.post(f"{self.base_url}{url}", headers=headers, json=body)
-            res.raise_for_status(); data = res.json()
-            if data and data.get('output') and data.get('rt_cd') == '0': return data['output']
-            else: self.add_log(f"⚠️ [{stock_code}] 종목 정보 없음: {data.get('msg1', 'API 응답 없음')}"); return None
-        except httpx.HTTPStatusError as e:
-            error_text = e.response.text; error_msg = error_text
-            try: error_data = e.response.json(); error_msg = error_data.get('msg1', error_text)
-            except: pass
-            self.add_log(f"❌ [{stock_code}] 종목 정보 HTTP 오류 {e.response.status_code}: {error_msg}")
-        except Exception as e: self.add_log(f"❌ [{stock_code}] 종목 정보 조회 오류: {e}")
+            res = await self.client.post(url_path, headers=headers, content=body, timeout=timeout or self.REST_TIMEOUT)
+            logger.debug("[API]   <- [{}] API 응답 수신 ({}). Status: {} ({})", tr_id, context, res.status_code, res.http_version)
+            if res.is_success:
+                return orjson.loads(res.content), None
+            # 2xx가 아니면 예외(raise_for_status)를 거치지 않고 바로 오류 dict 구성
+            error_msg = res.text
+            try: error_json = orjson.loads(res.content); error_msg = error_json.get('return_msg') or error_json.get('msg1') or error_msg
+            except (orjson.JSONDecodeError, AttributeError): pass # 본문이 JSON 객체가 아니면 원문 사용
+            self.add_log(f"❌ [API {tr_id}] ({context}) HTTP 오류 {res.status_code}: {error_msg}", "ERROR")
+            return None, {'return_code': res.status_code, 'return_msg': error_msg}
+        except httpx.RequestError as e:
+            self.add_log(f"❌ [API {tr_id}] ({context}) 네트워크 오류: {e}", "ERROR")
+            return None, {'return_code': -1, 'return_msg': str(e)}
+        except Exception as e:
+            logger.exception("[API] ❌ [API {}] ({}) 예상치 못한 오류: {}", tr_id, context, e)
+            return None, {'return_code': -99, 'return_msg': str(e)}
+
+    async def _request_stock_info(self, stock_code: str) -> Optional[Dict]:
+        tr_id = "ka10001"
+        data, error = await self._post(tr_id, self.URL_STKINFO, {"stk_cd": stock_code}, context=stock_code)
+        if error: return None
+        if data and data.get('output') and data.get('rt_cd') == '0':
+            return data['output']
+        self.add_log(f"⚠️ [{stock_code}] 종목 정보 없음: {data.get('msg1', 'API 응답 없음')}"); return None
+
+    async def _fetch_stock_details_chunk(self, stock_codes: List[str]) -> Optional[List[Dict]]:
+        tr_id = "ka10095"
+        context = f"{stock_codes[0]} 외 {len(stock_codes) - 1}종목"
+        data, error = await self._post(tr_id, self.URL_STKINFO, {"stk_cd": "|".join(stock_codes)}, context=context)
+        if error: return None
+        return_code, return_msg = self._parse_rc(data)
+        if return_code == 0 and isinstance(data.get('atn_stk_infr'), list):
+            return data['atn_stk_infr']
+        self.add_log(f"⚠️ [API {tr_id}] ({context}) 관심종목 정보 없음: {return_msg or 'API 응답 없음'} (return_code: {return_code})")
         return None
 
+    async def fetch_multiple_stock_details(self, stock_codes: List[str]) -> Optional[List[Dict]]:
+        """
+        여러 종목의 상세 정보(관심종목정보, ka10095)를 조회합니다.
+        중복 종목은 제거하고 STOCK_DETAILS_CHUNK개씩 나눠 동시에 요청하므로, 일부 묶음이 실패해도 나머지 결과는 반환합니다.
+        Returns: 종목별 정보 리스트 (모든 묶음이 실패하면 None)
+        """
+        codes = list(dict.fromkeys(stock_codes)) # 순서를 유지한 중복 제거
+        if not codes: return []
+        chunks = [codes[i:i + self.STOCK_DETAILS_CHUNK] for i in range(0, len(codes), self.STOCK_DETAILS_CHUNK)]
+        results = await self.gather_bounded(self._fetch_stock_details_chunk(chunk) for chunk in chunks)
+        details = [item for result in results if isinstance(result, list) for item in result]
+        failed = sum(1 for result in results if not isinstance(result, list))
+        if failed:
+            self.add_log(f"⚠️ [API ka10095] 상세 정보 {len(chunks)}개 묶음 중 {failed}개 실패 ({len(details)}건만 반환)", "WARNING")
+        return details if failed < len(chunks) else None
+
     async def fetch_minute_chart(self, stock_code: str, timeframe: int = 1) -> Optional[Dict]:
-        url = "/api/dostk/chart"; tr_id = "ka10080"
-        headers = await self._get_headers(tr_id)
-        if not headers: self.add_log(f"❌ [{stock_code}] 분봉 헤더 생성 실패."); return None
+        tr_id = "ka10080"
         body = {"stk_cd": stock_code, "tic_scope": str(timeframe), "upd_stkpc_tp": "0"}
-        try:
-            res = await self.client.post(f"{self.base_url}{url}", headers=headers, json=body)
-            res.raise_for_status(); data = res.json()
-            return_code = data.get('return_code')
-            return_msg = data.get('return_msg', '')
-            result_key = 'output2' if 'output2' in data else ('stk_min_pole_chart_qry' if 'stk_min_pole_chart_qry' in data else None)
-            result_data = data.get(result_key) if result_key else None
-            # self.add_log(f"  - [API_MIN_CHART] 응답 코드(return_code) ({stock_code}): {return_code}, 메시지: {return_msg}") # 로그 간소화
-            if (return_code == 0 or return_code == '0') and isinstance(result_data, list):
-                if result_data:
-                     # self.add_log(f"  ✅ [API_MIN_CHART] ({stock_code}) {timeframe}분봉 데이터 {len(result_data)}건 정상 반환") # 로그 간소화
-                     return {'stk_min_pole_chart_qry': result_data, 'return_code': 0} # 성공 시 return_code 포함
-                else:
-                    self.add_log(f"  ⚠️ [API_MIN_CHART] ({stock_code}) {timeframe}분봉 데이터 없음 (API 성공, 빈 리스트)."); return {'return_code': 0, 'stk_min_pole_chart_qry': []} # 성공이지만 데이터 없을 때
-            else:
-                error_msg = return_msg if return_msg else 'API 응답 데이터 없음 또는 형식 오류'
-                self.add_log(f"  ❌ [API_MIN_CHART] ({stock_code}) 처리 실패: {error_msg} (return_code: {return_code})")
-                self.add_log(f"  📄 [API_MIN_CHART] ({stock_code}) 실패 시 응답 일부: {str(data)[:200]}..."); return {'return_code': return_code, 'return_msg': error_msg} # 실패 시 return_code/msg 포함
-        except httpx.HTTPStatusError as e:
-            error_text = e.response.text; error_msg = error_text
-            try: error_json = e.response.json(); error_msg = error_json.get('return_msg', error_text)
-            except: pass
-            self.add_log(f"❌ [{stock_code}] 분봉 데이터 HTTP 오류 {e.response.status_code}: {error_msg}"); return {'return_code': e.response.status_code, 'return_msg': error_msg}
-        except httpx.RequestError as e: self.add_log(f"❌ [{stock_code}] 분봉 데이터 네트워크 오류: {e}"); return {'return_code': -1, 'return_msg': str(e)}
-        except Exception as e: self.add_log(f"❌ [{stock_code}] 분봉 데이터 조회 중 예상치 못한 오류: {e}"); self.add_log(traceback.format_exc()); return {'return_code': -99, 'return_msg': str(e)}
+        data, error = await self._post(tr_id, self.URL_CHART, body, context=stock_code, timeout=self.CHART_TIMEOUT)
+        if error: return error
+        return_code, return_msg = self._parse_rc(data)
+        result_key = 'output2' if 'output2' in data else ('stk_min_pole_chart_qry' if 'stk_min_pole_chart_qry' in data else None)
+        result_data = data.get(result_key) if result_key else None
+        if return_code == 0 and isinstance(result_data, list):
+            if result_data:
+                return {'stk_min_pole_chart_qry': result_data, 'return_code': 0} # 성공 시 return_code 포함
+            self.add_log(f"  ⚠️ [API_MIN_CHART] ({stock_code}) {timeframe}분봉 데이터 없음 (API 성공, 빈 리스트)."); return {'return_code': 0, 'stk_min_pole_chart_qry': []} # 성공이지만 데이터 없을 때
+        error_msg = return_msg if return_msg else 'API 응답 데이터 없음 또는 형식 오류'
+        self.add_log(f"  ❌ [API_MIN_CHART] ({stock_code}) 처리 실패: {error_msg} (return_code: {return_code})")
+        self.add_log(f"  📄 [API_MIN_CHART] ({stock_code}) 실패 시 응답 일부: {str(data)[:200]}..."); return {'return_code': return_code, 'return_msg': error_msg} # 실패 시 return_code/msg 포함
+
+    async def _bounded(self, coro):
+        """REST 동시 요청 수를 FAN_OUT_CONCURRENCY 이하로 제한하여 코루틴 실행"""
+        async with self._fan_out_semaphore:
+            return await coro
+
+    async def gather_bounded(self, coros) -> List:
+        """
+        서로 독립적인 REST 호출 코루틴들을 동시에 실행합니다. (동시 실행 수는 FAN_OUT_CONCURRENCY로 제한)
+        개별 호출의 예외는 전파하지 않고 결과 리스트에 예외 객체로 담아 반환합니다.
+        """
+        return await asyncio.gather(*(self._bounded(coro) for coro in coros), return_exceptions=True)
+
+    async def fetch_minute_charts_many(self, stock_codes: List[str], timeframe: int = 1) -> Dict[str, Optional[Dict]]:
+        """
+        여러 종목의 분봉 차트를 동시에 조회합니다. (동시 요청 수는 FAN_OUT_CONCURRENCY로 제한)
+        HTTP/2 클라이언트에서는 하나의 연결 위에서 요청이 다중화됩니다.
+        Returns: {종목코드: fetch_minute_chart 응답 (예외 발생 시 None)}
+        """
+        results = await self.gather_bounded(self.fetch_minute_chart(code, timeframe) for code in stock_codes)
+        return {code: (None if isinstance(result, BaseException) else result) for code, result in zip(stock_codes, results)}
 
     async def fetch_volume_surge_rank(self, **kwargs) -> Optional[Dict]:
         """거래량 급증 종목 랭킹 조회 (API ID: ka10023). 인자는 kwargs로 받음."""
-        url_path = "/api/dostk/rkinfo"; tr_id = "ka10023"
-        full_url = f"{self.base_url}{url_path}"
-        headers = await self._get_headers(tr_id)
-        if not headers: return {'return_code': -1, 'return_msg': '헤더 생성 실패'}
-
-        # 기본 파라미터 설정 및 kwargs로 오버라이드
-        default_params = {
-            'mrkt_tp': '000', 'sort_tp': '2', 'tm_tp': '1', 'tm': '5',
-            'trde_qty_tp': '10', 'stk_cnd': '14', 'pric_tp': '8', 'stex_tp': '3'
-        }
-        raw_body = {**default_params, **kwargs} # kwargs로 기본값 덮어쓰기
-
-        # --- 👇 타입 변환 로직 추가 ---
-        body = {}
-        for key, value in raw_body.items():
-            if key in ['tm', 'trde_qty_tp'] and isinstance(value, (int, float)):
-                # tm과 trde_qty_tp 파라미터를 문자열로 변환
-                body[key] = str(value)
-            elif key == 'trde_qty_tp' and isinstance(value, str):
-                # trde_qty_tp가 문자열일 경우, 앞에 0을 붙여 4자리로 만드는 로직 (API 문서 길이 오류 가능성 대비)
-                # 예: '10' -> '0010', '100' -> '0100' (필요 없을 경우 이 elif 블록 제거)
-                # body[key] = value.zfill(4)
-                body[key] = value # 우선 원본 문자열 사용
-            else:
-                body[key] = value
-        # --- 👆 타입 변환 로직 추가 끝 ---
-
-        try:
-            # 수정된 body 사용
-            self.add_log(f"🔍 [API {tr_id}] 거래량 급증 요청 Body: {body}")
-            res = await self.client.post(full_url, headers=headers, json=body)
-            res.raise_for_status(); data = res.json()
-
-            # ... (이하 try 구문 동일) ...
-
-            return_code = data.get('return_code')
-            return_msg = data.get('return_msg', '')
-
-            if return_code == 0 or return_code == '0':
-                return data
-            else:
-                self.add_log(f"⚠️ [API {tr_id}] 거래량 급증 데이터 없음: {return_msg} (return_code: {return_code})")
-                self.add_log(f"📄 API Raw Response: {data}")
-                return {'return_code': return_code, 'return_msg': return_msg}
-        except httpx.HTTPStatusError as e:
-            error_text = e.response.text; error_msg = error_text
-            try: error_json = e.response.json(); error_msg = error_json.get('return_msg', error_text)
-            except: pass
-            self.add_log(f"❌ [API {tr_id}] 거래량 급증 오류 (HTTP {e.response.status_code}): {error_msg}")
-            return {'return_code': e.response.status_code, 'return_msg': error_msg}
-        except httpx.RequestError as e:
-            self.add_log(f"❌ [API {tr_id}] 거래량 급증 네트워크 오류: {e}")
-            return {'return_code': -1, 'return_msg': str(e)}
-        except Exception as e:
-            self.add_log(f"❌ [API {tr_id}] 예상치 못한 오류 (fetch_volume_surge_rank): {e}")
-            self.add_log(traceback.format_exc())
-            return {'return_code': -99, 'return_msg': str(e)}
+        tr_id = "ka10023"
+        # 기본 파라미터에 kwargs 덮어쓰기 후, 숫자로 들어올 수 있는 tm / trde_qty_tp만 문자열로 변환
+        body = dict(_VOLUME_SURGE_DEFAULTS)
+        body.update(kwargs)
+        body['tm'] = str(body['tm'])
+        body['trde_qty_tp'] = str(body['trde_qty_tp'])
+        self.add_log(f"🔍 [API {tr_id}] 거래량 급증 요청 Body: {body}")
+        data, error = await self._post(tr_id, self.URL_RKINFO, body, context="거래량 급증")
+        if error: return error
+        return_code, return_msg = self._parse_rc(data)
+        if return_code == 0:
+            return data
+        self.add_log(f"⚠️ [API {tr_id}] 거래량 급증 데이터 없음: {return_msg} (return_code: {return_code})")
+        self.add_log(f"📄 API Raw Response: {data}")
+        return {'return_code': return_code, 'return_msg': return_msg}
+
+    def _build_order_body(self, stock_code: str, quantity: int, price: Optional[int]) -> Optional[str]:
+        """매수/매도 주문 JSON body 문자열 생성 (가격이 없거나 0 이하면 시장가). 종목코드 형식이 잘못되면 None"""
+        if not self.STOCK_CODE_PATTERN.fullmatch(stock_code): return None
+        if price is not None and price > 0:
+            return self.ORDER_BODY_TEMPLATE % (stock_code, quantity, price, "0") # 지정가
+        return self.ORDER_BODY_TEMPLATE % (stock_code, quantity, "", "3") # 시장가
+
+    def _build_cancel_body(self, order_no: str, stock_code: str, quantity: int) -> Optional[str]:
+        """취소 주문 JSON body 문자열 생성. 원주문번호/종목코드 형식이 잘못되면 None"""
+        if not (self.STOCK_CODE_PATTERN.fullmatch(stock_code) and self.STOCK_CODE_PATTERN.fullmatch(order_no)): return None
+        return self.CANCEL_BODY_TEMPLATE % (order_no, stock_code, quantity)
+
+    async def _send_order(self, tag: str, tr_id: str, body: Optional[str], context: str) -> Optional[Dict]:
+        """
+        주문 TR(매수/매도/취소) 공통 전송 및 응답 처리. 성공/실패 모두 응답 전체(return_code 정규화)를 반환
+        body가 None(종목코드/주문번호 형식 오류)이면 요청하지 않고 None 반환
+        """
+        if body is None: self.add_log(f"❌ [{tag}_{tr_id}] 실패: 잘못된 종목코드/주문번호 ({context}).", "ERROR"); return None
+        logger.debug("[API]   -> [{}_{}] API 요청 시도 ({})... Body: {}", tag, tr_id, context, body)
+        data, error = await self._post(tr_id, self.URL_ORDR, body, is_order=True, context=context)
+        if error: return error
+        return_code, return_msg = self._parse_rc(data)
+        order_no = data.get('ord_no')
+        logger.debug("[API]   - [{}_{}] 응답 처리 시작 ({}): code={}, msg={}, ord_no={}", tag, tr_id, context, return_code, return_msg, order_no)
+        if return_code == 0 and order_no:
+            self.add_log(f"  ✅ [{tag}_{tr_id}] 성공 ({context}): 주문번호={order_no}"); return data # 성공 시 전체 응답 반환
+        error_msg = return_msg if return_msg else 'API 응답 없음 또는 형식 오류'
+        self.add_log(f"  ❌ [{tag}_{tr_id}] 실패 ({context}): {error_msg} (return_code: {return_code})", "ERROR")
+        logger.debug("[API] 📄 API Raw Response: {}", data); return data # 실패 시에도 전체 응답 반환 (오류 코드 포함)
 
     async def create_buy_order(self, stock_code: str, quantity: int, price: Optional[int] = None) -> Optional[Dict]:
-        url_path = "/api/dostk/ordr"; tr_id = "kt10000"
-        full_url = f"{self.base_url}{url_path}"
-        self.add_log(f"  -> [CREATE_BUY_{tr_id}] 시작: 종목({stock_code}), 수량({quantity}), 가격({price})")
-        headers = await self._get_headers(tr_id, is_order=True)
-        if not headers: self.add_log(f"❌ [CREATE_BUY_{tr_id}] 실패: 헤더 생성 실패 ({stock_code})."); return None
-        order_price_str = str(price) if price is not None and price > 0 else ""
-        trade_type = "0" if price is not None and price > 0 else "3"
-        body = { "dmst_stex_tp": "KRX", "stk_cd": stock_code, "ord_qty": str(quantity), "ord_uv": order_price_str, "trde_tp": trade_type, "cond_uv": "" }
-        try:
-            self.add_log(f"  -> [CREATE_BUY_{tr_id}] API 요청 시도 ({stock_code})... Body: {body}")
-            res = await self.client.post(full_url, headers=headers, json=body)
-            self.add_log(f"  <- [CREATE_BUY_{tr_id}] API 응답 수신 ({stock_code}). Status: {res.status_code}")
-            res.raise_for_status(); data = res.json()
-            self.add_log(f"  <- [CREATE_BUY_{tr_id}] API 응답 JSON 파싱 완료 ({stock_code}).")
-            return_code = data.get('return_code')
-            return_msg = data.get('return_msg', '')
-            order_no = data.get('ord_no')
-            self.add_log(f"  - [CREATE_BUY_{tr_id}] 응답 처리 시작 ({stock_code}): code={return_code}, msg={return_msg}, ord_no={order_no}")
-            if (return_code == 0 or return_code == '0') and order_no:
-                self.add_log(f"  ✅ [CREATE_BUY_{tr_id}] 성공 ({stock_code}): 주문번호={order_no}"); return data # 성공 시 전체 응답 반환
-            else:
-                error_msg = return_msg if return_msg else 'API 응답 없음 또는 형식 오류'
-                self.add_log(f"  ❌ [CREATE_BUY_{tr_id}] 실패 ({stock_code}): {error_msg} (return_code: {return_code})")
-                self.add_log(f"📄 API Raw Response: {data}"); return data # 실패 시에도 전체 응답 반환 (오류 코드 포함)
-        except httpx.HTTPStatusError as e:
-            error_text = e.response.text; error_msg = error_text
-            try: error_json = e.response.json(); error_msg = error_json.get('return_msg', error_text)
-            except: pass
-            self.add_log(f"  ❌ [CREATE_BUY_{tr_id}] HTTP 오류 ({stock_code}, Status:{e.response.status_code}): {error_msg}"); print(traceback.format_exc()); return {'return_code': e.response.status_code, 'return_msg': error_msg}
-        except httpx.RequestError as e: self.add_log(f"  ❌ [CREATE_BUY_{tr_id}] 네트워크 오류 ({stock_code}): {e}"); print(traceback.format_exc()); return {'return_code': -1, 'return_msg': str(e)}
-        except Exception as e: self.add_log(f"  ❌ [CREATE_BUY_{tr_id}] 예상치 못한 오류 ({stock_code}): {e}"); print(traceback.format_exc()); return {'return_code': -99, 'return_msg': str(e)}
-        # self.add_log(f"  -> [CREATE_BUY_{tr_id}] 함수 종료 (None 반환 예정) ({stock_code})."); return None # 로깅 변경
+        logger.debug("[API]   -> [CREATE_BUY] 시작: 종목({}), 수량({}), 가격({})", stock_code, quantity, price)
+        return await self._send_order("CREATE_BUY", "kt10000", self._build_order_body(stock_code, quantity, price), stock_code)
 
     async def create_sell_order(self, stock_code: str, quantity: int, price: Optional[int] = None) -> Optional[Dict]:
-        url_path = "/api/dostk/ordr"; tr_id = "kt10001" # 매도 API ID 확인 (kt10001 사용)
-        full_url = f"{self.base_url}{url_path}"
-        self.add_log(f"  -> [CREATE_SELL_{tr_id}] 시작: 종목({stock_code}), 수량({quantity}), 가격({price})")
-        headers = await self._get_headers(tr_id, is_order=True)
-        if not headers: self.add_log(f"❌ [CREATE_SELL_{tr_id}] 실패: 헤더 생성 실패 ({stock_code})."); return None
-        order_price_str = str(price) if price is not None and price > 0 else ""
-        trade_type = "0" if price is not None and price > 0 else "3"
-        body = { "dmst_stex_tp": "KRX", "stk_cd": stock_code, "ord_qty": str(quantity), "ord_uv": order_price_str, "trde_tp": trade_type, "cond_uv": "" }
-        try:
-            self.add_log(f"  -> [CREATE_SELL_{tr_id}] API 요청 시도 ({stock_code})... Body: {body}")
-            res = await self.client.post(full_url, headers=headers, json=body)
-            self.add_log(f"  <- [CREATE_SELL_{tr_id}] API 응답 수신 ({stock_code}). Status: {res.status_code}")
-            res.raise_for_status(); data = res.json()
-            self.add_log(f"  <- [CREATE_SELL_{tr_id}] API 응답 JSON 파싱 완료 ({stock_code}).")
-            return_code = data.get('return_code')
-            return_msg = data.get('return_msg', '')
-            order_no = data.get('ord_no')
-            self.add_log(f"  - [CREATE_SELL_{tr_id}] 응답 처리 시작 ({stock_code}): code={return_code}, msg={return_msg}, ord_no={order_no}")
-            if (return_code == 0 or return_code == '0') and order_no:
-                self.add_log(f"  ✅ [CREATE_SELL_{tr_id}] 성공 ({stock_code}): 주문번호={order_no}"); return data
-            else:
-                error_msg = return_msg if return_msg else 'API 응답 없음 또는 형식 오류'
-                self.add_log(f"  ❌ [CREATE_SELL_{tr_id}] 실패 ({stock_code}): {error_msg} (return_code: {return_code})")
-                self.add_log(f"📄 API Raw Response: {data}"); return data
-        except httpx.HTTPStatusError as e:
-            error_text = e.response.text; error_msg = error_text
-            try: error_json = e.response.json(); error_msg = error_json.get('return_msg', error_text)
-            except: pass
-            self.add_log(f"  ❌ [CREATE_SELL_{tr_id}] HTTP 오류 ({stock_code}, Status:{e.response.status_code}): {error_msg}"); print(traceback.format_exc()); return {'return_code': e.response.status_code, 'return_msg': error_msg}
-        except httpx.RequestError as e: self.add_log(f"  ❌ [CREATE_SELL_{tr_id}] 네트워크 오류 ({stock_code}): {e}"); print(traceback.format_exc()); return {'return_code': -1, 'return_msg': str(e)}
-        except Exception as e: self.add_log(f"  ❌ [CREATE_SELL_{tr_id}] 예상치 못한 오류 ({stock_code}): {e}"); print(traceback.format_exc()); return {'return_code': -99, 'return_msg': str(e)}
-        # self.add_log(f"  -> [CREATE_SELL_{tr_id}] 함수 종료 (None 반환 예정) ({stock_code})."); return None
+        logger.debug("[API]   -> [CREATE_SELL] 시작: 종목({}), 수량({}), 가격({})", stock_code, quantity, price)
+        return await self._send_order("CREATE_SELL", "kt10001", self._build_order_body(stock_code, quantity, price), stock_code) # 매도 API ID 확인 (kt10001 사용)
 
     async def cancel_order(self, order_no: str, stock_code: str, quantity: int = 0) -> Optional[Dict]:
-        url_path = "/api/dostk/ordr"; tr_id = "kt10003" # 취소 API ID 확인 (kt10003 사용)
-        full_url = f"{self.base_url}{url_path}"
-        self.add_log(f"  -> [CANCEL_ORDER_{tr_id}] 시작: 원주문({order_no}), 종목({stock_code}), 수량({quantity})")
-        headers = await self._get_headers(tr_id, is_order=True)
-        if not headers: self.add_log(f"❌ [CANCEL_ORDER_{tr_id}] 실패: 헤더 생성 실패 ({stock_code})."); return None
-        cancel_qty_str = "0" if quantity == 0 else str(quantity)
-        body = { "dmst_stex_tp": "KRX", "orig_ord_no": order_no, "stk_cd": stock_code, "cncl_qty": cancel_qty_str }
-        try:
-            self.add_log(f"  -> [CANCEL_ORDER_{tr_id}] API 요청 시도 ({stock_code})... Body: {body}")
-            res = await self.client.post(full_url, headers=headers, json=body)
-            self.add_log(f"  <- [CANCEL_ORDER_{tr_id}] API 응답 수신 ({stock_code}). Status: {res.status_code}")
-            res.raise_for_status(); data = res.json()
-            self.add_log(f"  <- [CANCEL_ORDER_{tr_id}] API 응답 JSON 파싱 완료 ({stock_code}).")
-            return_code = data.get('return_code')
-            return_msg = data.get('return_msg', '')
-            new_ord_no = data.get('ord_no')
-            self.add_log(f"  - [CANCEL_ORDER_{tr_id}] 응답 처리 시작 ({stock_code}): code={return_code}, msg={return_msg}, new_ord_no={new_ord_no}")
-            if (return_code == 0 or return_code == '0') and new_ord_no:
-                self.add_log(f"  ✅ [CANCEL_ORDER_{tr_id}] 성공 ({stock_code}): 원주문={order_no}, 취소주문={new_ord_no}"); return data
-            else:
-                error_msg = return_msg if return_msg else 'API 응답 없음 또는 형식 오류'
-                self.add_log(f"  ❌ [CANCEL_ORDER_{tr_id}] 실패 ({stock_code}): {error_msg} (return_code: {return_code})")
-                self.add_log(f"📄 API Raw Response: {data}"); return data
-        except httpx.HTTPStatusError as e:
-            error_text = e.response.text; error_msg = error_text
-            try: error_json = e.response.json(); error_msg = error_json.get('return_msg', error_text)
-            except: pass
-            self.add_log(f"  ❌ [CANCEL_ORDER_{tr_id}] HTTP 오류 ({stock_code}, Status:{e.response.status_code}): {error_msg}"); print(traceback.format_exc()); return {'return_code': e.response.status_code, 'return_msg': error_msg}
-        except httpx.RequestError as e: self.add_log(f"  ❌ [CANCEL_ORDER_{tr_id}] 네트워크 오류 ({stock_code}): {e}"); print(traceback.format_exc()); return {'return_code': -1, 'return_msg': str(e)}
-        except Exception as e: self.add_log(f"  ❌ [CANCEL_ORDER_{tr_id}] 예상치 못한 오류 ({stock_code}): {e}"); print(traceback.format_exc()); return {'return_code': -99, 'return_msg': str(e)}
-        # self.add_log(f"  -> [CANCEL_ORDER_{tr_id}] 함수 종료 (None 반환 예정) ({stock_code})."); return None
+        logger.debug("[API]   -> [CANCEL_ORDER] 시작: 원주문({}), 종목({}), 수량({})", order_no, stock_code, quantity)
+        return await self._send_order("CANCEL_ORDER", "kt10003", self._build_cancel_body(order_no, stock_code, quantity), # 취소 API ID 확인 (kt10003 사용)
+                                      f"{stock_code}, 원주문={order_no}")
 
     async def fetch_account_balance(self) -> Optional[Dict]:
-        url_path = "/api/dostk/acnt"; tr_id = "kt00001"
-        full_url = f"{self.base_url}{url_path}"
-        headers = await self._get_headers(tr_id, is_order=True) # is_order=True 추가
-        if not headers: self.add_log("❌ 예수금 조회 실패: 헤더 생성 실패."); return None
-        body = {"qry_tp": "2"}
-        try:
-            res = await self.client.post(full_url, headers=headers, json=body)
-            res.raise_for_status(); data = res.json()
-            return_code = data.get('return_code')
-            return_msg = data.get('return_msg', '')
-            balance_info = data
-            if (return_code == 0 or return_code == '0'):
-                if 'ord_alow_amt' in balance_info:
-                    return balance_info
-                else:
-                    self.add_log(f"⚠️ [API {tr_id}] 예수금 조회 성공했으나 'ord_alow_amt' 필드 없음."); self.add_log(f"📄 API Raw Response: {data}"); return {'return_code': 0, 'return_msg': "'ord_alow_amt' missing"}
-            else:
-                error_msg = return_msg if return_msg else 'API 응답 없음 또는 형식 오류'
-                self.add_log(f"⚠️ [API {tr_id}] 예수금 데이터 없음: {error_msg} (return_code: {return_code})"); self.add_log(f"📄 API Raw Response: {data}"); return {'return_code': return_code, 'return_msg': error_msg}
-        except httpx.HTTPStatusError as e:
-            error_text = e.response.text; error_msg = error_text
-            try: error_json = e.response.json(); error_msg = error_json.get('return_msg', error_text)
-            except: pass
-            self.add_log(f"❌ [API {tr_id}] 예수금 조회 오류 (HTTP {e.response.status_code}): {error_msg}"); return {'return_code': e.response.status_code, 'return_msg': error_msg}
-        except httpx.RequestError as e: self.add_log(f"❌ [API {tr_id}] 예수금 조회 네트워크 오류: {e}"); return {'return_code': -1, 'return_msg': str(e)}
-        except Exception as e: self.add_log(f"❌ [API {tr_id}] 예수금 조회 중 예상치 못한 오류: {e}"); print(traceback.format_exc()); return {'return_code': -99, 'return_msg': str(e)}
+        """
+        예수금 조회 (kt00001). 잔고는 체결 시에만 바뀌므로 성공 응답은 TR_CACHE_TTL 동안 캐시
+        (주문 체결/잔고 실시간 통보를 받으면 invalidate_account_balance로 즉시 무효화)
+        """
+        return await self._cached_tr("kt00001", "", self._request_account_balance)
+
+    def invalidate_account_balance(self):
+        """캐시된 예수금 응답 폐기 (다음 fetch_account_balance는 서버에 새로 조회)"""
+        self._tr_cache.pop(("kt00001", ""), None)
+
+    async def _request_account_balance(self) -> Optional[Dict]:
+        tr_id = "kt00001"
+        data, error = await self._post(tr_id, self.URL_ACNT, self.ACCOUNT_BALANCE_BODY, is_order=True, context="예수금") # is_order=True 추가
+        if error: return error
+        return_code, return_msg = self._parse_rc(data)
+        if return_code == 0:
+            if 'ord_alow_amt' in data:
+                return data
+            self.add_log(f"⚠️ [API {tr_id}] 예수금 조회 성공했으나 'ord_alow_amt' 필드 없음."); self.add_log(f"📄 API Raw Response: {data}"); return {'return_code': -1, 'return_msg': "'ord_alow_amt' missing"} # 필드 누락은 실패로 간주 (캐시하지 않음)
+        error_msg = return_msg if return_msg else 'API 응답 없음 또는 형식 오류'
+        self.add_log(f"⚠️ [API {tr_id}] 예수금 데이터 없음: {error_msg} (return_code: {return_code})"); self.add_log(f"📄 API Raw Response: {data}"); return {'return_code': return_code, 'return_msg': error_msg}
 
     # --- 👇 주식 호가 데이터 요청 함수 추가 ---
     async def fetch_orderbook(self, stock_code: str) -> Optional[Dict]:
-      """주식 호가 잔량 데이터를 요청합니다. (API ID: ka10004)"""
-      url = "/api/dostk/mrkcond" # API 문서상 URL 확인 필요 (ka10004)
-      tr_id = "ka10004" # API ID
-
-      try:
-        headers = await self._get_headers(tr_id)
-        body = {"stk_cd": stock_code}
-
-        res = await self.client.post(f"{self.base_url}{url}", headers=headers, json=body)
-        res.raise_for_status() # HTTP 오류 발생 시 예외 발생
+      """주식 호가 잔량 데이터를 요청합니다. (API ID: ka10004, 같은 틱 내 중복 조회는 TR_CACHE_TTL 동안 캐시 응답 사용)"""
+      return await self._cached_tr("ka10004", stock_code, lambda: self._request_orderbook(stock_code))
 
-        data = res.json()
-        # API 응답 구조 확인 (예: return_code가 있는지)
-        if data.get('return_code') == 0:
-            self.add_log(f"✅ [{stock_code}] 호가 데이터 조회 성공") # add_log 대신 print 사용
-            # print(f"✅ [{stock_code}] 호가 데이터 조회 성공")
-            return data # 성공 시 전체 응답 데이터 반환
-        else:
-            error_msg = data.get('return_msg', '알 수 없는 오류')
-            # print(f"❌ [{stock_code}] 호가 데이터 조회 실패: {error_msg}")
-            self.add_log(f"❌ [{stock_code}] 호가 데이터 조회 실패: {error_msg}") # add_log 대신 print 사용
-            return None
-
-      except httpx.HTTPStatusError as e:
-        try:
-            error_data = e.response.json()
-            error_msg = error_data.get('return_msg', e.response.text)
-        except json.JSONDecodeError:
-            error_msg = e.response.text
-        # print(f"❌ [{stock_code}] 호가 데이터 조회 실패 (HTTP 오류): {e.response.status_code} - {error_msg}")
-        self.add_log(f"❌ [{stock_code}] 호가 데이터 조회 실패 (HTTP 오류): {e.response.status_code} - {error_msg}") # add_log 대신 print 사용
-      except Exception as e:
-        # print(f"❌ [{stock_code}] 예상치 못한 오류 발생 (fetch_orderbook): {e}")
-        self.add_log(f"❌ [{stock_code}] 예상치 못한 오류 발생 (fetch_orderbook): {e}") # add_log 대신 print 사용
+    async def _request_orderbook(self, stock_code: str) -> Optional[Dict]:
+      tr_id = "ka10004" # API ID
+      # API 문서상 URL 확인 필요 (ka10004)
+      data, error = await self._post(tr_id, self.URL_MRKCOND, {"stk_cd": stock_code}, context=stock_code, timeout=self.ORDERBOOK_TIMEOUT)
+      if error: return None
+      # API 응답 구조 확인 (예: return_code가 있는지)
+      if self._parse_rc(data)[0] == 0:
+          self.add_log(f"✅ [{stock_code}] 호가 데이터 조회 성공")
+          return data # 성공 시 전체 응답 데이터 반환
+      error_msg = data.get('return_msg', '알 수 없는 오류')
+      self.add_log(f"❌ [{stock_code}] 호가 데이터 조회 실패: {error_msg}")
       return None
 
     def _split_account_no(self) -> Optional[tuple[str, str]]:
+        """__init__에서 미리 분리해 둔 (계좌번호 8자리, 상품코드 2자리) 반환"""
+        return self._account_parts
+
+    def _parse_account_no(self) -> Optional[tuple[str, str]]:
         clean_account_no = self.account_no.replace('-', '') if self.account_no else ""
         account_prefix = ""; account_suffix = ""
         if len(clean_account_no) == 8:
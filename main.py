@@ -3,6 +3,10 @@ import signal
 import sys
 from loguru import logger
 from core.engine import TradingEngine
+try:
+    import uvloop # libuv 기반 이벤트 루프 (Windows 미지원 -> 없으면 기본 asyncio 루프 사용)
+except ImportError:
+    uvloop = None
 from config.loader import config
 
 # --- 👇 Loguru 초기 설정 ---
@@ -13,13 +17,16 @@ def setup_logging():
     log_config = config.logging # loader.py 에서 정의된 Config 객체 사용 가정
     log_directory = log_config.directory
     log_file_path = f"{log_directory}/bot.log" # 메인 로그 파일
+    error_log_file_path = f"{log_directory}/errors.log" # 오류(예외 상세) 로그 파일
 
     # 1. 콘솔(stdout) 핸들러 추가
     logger.add(
         sys.stdout,
         level=log_config.level.upper(), # config에서 로그 레벨 설정
         format=log_config.format,
-        colorize=True
+        colorize=True,
+        # 콘솔 출력(특히 파이프/systemd 리다이렉션)이 막혀도 이벤트 루프가 멈추지 않도록 별도 스레드에서 기록
+        enqueue=True
     )
 
     # 2. 파일 핸들러 추가 (회전 및 보관 설정 적용)
@@ -30,8 +37,23 @@ def setup_logging():
         rotation=log_config.rotation,  # 예: "10 MB"
         retention=log_config.retention, # 예: "7 days"
         encoding="utf-8",
+        # 레코드마다 write 시스템 호출을 하지 않도록 64KB 단위로 모아서 기록 (open()에 그대로 전달됨, 종료 시 flush)
+        buffering=64 * 1024,
         # 비동기 환경에서 안전하게 파일 쓰기 보장
         enqueue=True, # 중요: 비동기 로깅 활성화
+        backtrace=False, # 상세 스택 트레이스는 아래 오류 전용 파일에만 기록
+        diagnose=False
+    )
+
+    # 3. 오류 전용 파일 핸들러 (ERROR 이상만, 버퍼링 없이 바로 기록하여 비정상 종료 시에도 남도록)
+    logger.add(
+        error_log_file_path,
+        level="ERROR",
+        format=log_config.format,
+        rotation=log_config.rotation,
+        retention=log_config.retention,
+        encoding="utf-8",
+        enqueue=True,
         backtrace=True, # 오류 발생 시 스택 트레이스 포함
         diagnose=True   # 오류 발생 시 변수 값 등 상세 정보 포함
     )
@@ -50,10 +72,13 @@ async def main():
     # --- 종료 신호 처리 (기존 로직 유지) ---
     loop = asyncio.get_running_loop()
 
+    # 신호 처리기에서는 이벤트만 설정하고, 종료 절차는 아래 main 흐름에서 순서대로 진행
+    stop_requested = asyncio.Event()
+
     def signal_handler():
         # logger 사용
         logger.warning("⌨️ Ctrl+C 감지. 엔진 종료 신호 전송...")
-        asyncio.create_task(engine.stop()) # engine.stop() 호출 유지
+        stop_requested.set()
 
     try:
         loop.add_signal_handler(signal.SIGINT, signal_handler)
@@ -64,7 +89,14 @@ async def main():
     try:
         # logger 사용
         logger.info("▶️ 트레이딩 엔진 비동기 시작 (engine.start)")
-        await engine.start() # 수정된 부분 확인
+        engine_task = asyncio.create_task(engine.start())
+        stop_wait_task = asyncio.create_task(stop_requested.wait())
+        # 엔진이 스스로 종료되거나 Ctrl+C 신호가 올 때까지 대기
+        await asyncio.wait({engine_task, stop_wait_task}, return_when=asyncio.FIRST_COMPLETED)
+        stop_wait_task.cancel()
+        if not engine_task.done():
+            await engine.stop() # 엔진 메인 루프가 종료 신호를 받아 shutdown까지 마치도록 함
+        await engine_task
         logger.info("⏹️ 트레이딩 엔진 정상 종료 (engine.start 완료)")
     except asyncio.CancelledError:
         logger.warning("🔶 메인 태스크 취소됨 (엔진 종료 과정일 수 있음).")
@@ -82,7 +114,10 @@ if __name__ == "__main__":
 
     # --- 👇 메인 실행 로직을 try-except-finally로 감쌈 ---
     try:
-        asyncio.run(main())
+        if uvloop is not None:
+            uvloop.run(main()) # 웹소켓/REST 소켓 I/O 처리를 C 레벨 이벤트 루프에서 수행
+        else:
+            asyncio.run(main())
     except KeyboardInterrupt:
         logger.warning("⌨️ 사용자에 의해 프로그램 강제 종료 (KeyboardInterrupt in main)")
     except Exception as e:
@@ -92,5 +127,5 @@ if __name__ == "__main__":
         logger.exception(e) # 스택 트레이스 포함 로깅
     finally:
         logger.info("--- 🛑 프로그램 최종 종료 ---")
-        # Loguru가 파일 버퍼를 비우도록 잠시 대기 (필요시)
-        # asyncio.run(asyncio.sleep(0.1)) # 필요에 따라 추가
+        # enqueue 핸들러의 대기열에 남은 로그가 모두 기록될 때까지 대기
+        logger.complete()
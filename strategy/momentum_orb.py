@@ -1,8 +1,27 @@
+import math
 import pandas as pd
-from typing import Dict
+from loguru import logger
+from typing import Dict, Optional
 from config.loader import config # 설정 로더 import
 
-# ❗️ 임계값을 config 객체에서 직접 사용 (전역 변수 불필요)
+# 진입 조건 설정값 - 틱마다 호출되는 check_breakout_signal에서 설정 객체 속성을 반복 조회하지 않도록 모듈 변수로 보관
+# (설정은 프로그램 시작 시 한 번만 로드되므로 import 시점의 값으로 고정)
+_BREAKOUT_MULTIPLIER = 1 + config.strategy.breakout_buffer / 100
+_RVOL_THRESHOLD = config.strategy.rvol_threshold
+_OBI_THRESHOLD = config.strategy.obi_threshold
+_STRENGTH_THRESHOLD = config.strategy.strength_threshold
+_EMA_SHORT_COL = f'EMA_{config.strategy.ema_short_period}'
+_EMA_LONG_COL = f'EMA_{config.strategy.ema_long_period}'
+
+def _latest_value(latest: pd.Series, col: str) -> Optional[float]:
+  """최근 행(Series)에서 지표 값을 꺼냄. 컬럼이 없거나 NaN이면 None"""
+  value = latest.get(col)
+  # 지표 컬럼은 숫자형이므로 스칼라 NaN 판정은 pandas 대신 math.isnan으로 처리
+  return None if value is None or math.isnan(value) else value
+
+def _fmt(value: Optional[float]) -> str:
+  """로그용 지표 값 표기 (None이면 'N/A')"""
+  return f"{value:.2f}" if value is not None else "N/A"
 
 def check_breakout_signal(
     df: pd.DataFrame,
@@ -21,66 +40,56 @@ def check_breakout_signal(
   if df.empty or orb_levels.empty:
     return "HOLD"
 
-  current_price = df['close'].iloc[-1]
   orh = orb_levels.get('orh')
   orl = orb_levels.get('orl')
 
   if orh is None or orl is None:
     return "HOLD" # ORB가 아직 계산되지 않았으면 관망
 
-  # --- 지표 값 가져오기 (가장 최근 값) ---
-  latest_rvol = df['rvol'].iloc[-1] if 'rvol' in df.columns and not pd.isna(df['rvol'].iloc[-1]) else None # NaN도 None 처리
-  latest_obi = df['obi'].iloc[-1] if 'obi' in df.columns and not pd.isna(df['obi'].iloc[-1]) else None       # NaN도 None 처리
-
-  # EMA 컬럼명을 config 값으로 동적 생성
-  ema_short_col = f'EMA_{config.strategy.ema_short_period}'
-  ema_long_col = f'EMA_{config.strategy.ema_long_period}'
-  latest_ema_short = df[ema_short_col].iloc[-1] if ema_short_col in df.columns else None
-  latest_ema_long = df[ema_long_col].iloc[-1] if ema_long_col in df.columns else None
-  latest_strength = df['strength'].iloc[-1] if 'strength' in df.columns and not pd.isna(df['strength'].iloc[-1]) else None
-  
-  # --- 돌파 기준 가격 계산 (config 값 사용) ---
-  buy_trigger_price = orh * (1 + config.strategy.breakout_buffer / 100)
-
-  # --- 1. ORB 상단 돌파 확인 ---
+  # --- 돌파 기준 가격 계산 (설정 버퍼 반영) ---
+  buy_trigger_price = orh * _BREAKOUT_MULTIPLIER
+
+  # --- 1. ORB 상단 돌파 확인 (대부분의 틱은 여기서 끝나므로 필터 지표를 읽기 전에 먼저 판단) ---
+  current_price = df['close'].iat[-1]
   is_breakout = current_price > buy_trigger_price
   if not is_breakout:
     return "HOLD"
 
-  print(f"🚀 ORB 상단 돌파: 현재가({current_price}) > 매수 트리거({buy_trigger_price:.2f})")
+  # --- 지표 값 가져오기 (가장 최근 행을 한 번만 조회, 컬럼이 없거나 NaN이면 None) ---
+  latest = df.iloc[-1]
+  latest_rvol = _latest_value(latest, 'rvol')
+  latest_obi = _latest_value(latest, 'obi')
 
-  # --- 2. 진입 필터 조건 확인 (config 값 사용) ---
+  # EMA 컬럼명은 설정값으로 미리 만들어 둔 이름 사용
+  latest_ema_short = _latest_value(latest, _EMA_SHORT_COL)
+  latest_ema_long = _latest_value(latest, _EMA_LONG_COL)
+  latest_strength = _latest_value(latest, 'strength')
+
+  logger.debug("🚀 ORB 상단 돌파: 현재가({}) > 매수 트리거({:.2f})", current_price, buy_trigger_price)
+
+  # --- 2. 진입 필터 조건 확인 (설정 임계값 사용) ---
   # RVOL 조건
-  rvol_ok = latest_rvol is not None and latest_rvol >= config.strategy.rvol_threshold
-  # ✅ None 체크 후 포맷팅 또는 'N/A' 출력
-  rvol_str = f"{latest_rvol:.2f}" if latest_rvol is not None else "N/A"
-  print(f"   - RVOL Check: {rvol_str} >= {config.strategy.rvol_threshold} -> {'OK' if rvol_ok else 'NG'}")
+  rvol_ok = latest_rvol is not None and latest_rvol >= _RVOL_THRESHOLD
+  logger.debug("   - RVOL Check: {} >= {} -> {}", _fmt(latest_rvol), _RVOL_THRESHOLD, 'OK' if rvol_ok else 'NG')
 
   # OBI 조건
-  obi_ok = latest_obi is not None and latest_obi >= config.strategy.obi_threshold
-  # ✅ None 체크 후 포맷팅 또는 'N/A' 출력
-  obi_str = f"{latest_obi:.2f}" if latest_obi is not None else "N/A"
-  print(f"   - OBI Check: {obi_str} >= {config.strategy.obi_threshold} -> {'OK' if obi_ok else 'NG'}")
+  obi_ok = latest_obi is not None and latest_obi >= _OBI_THRESHOLD
+  logger.debug("   - OBI Check: {} >= {} -> {}", _fmt(latest_obi), _OBI_THRESHOLD, 'OK' if obi_ok else 'NG')
 
   # 상승 모멘텀 조건 (EMA)
   momentum_ok = (latest_ema_short is not None and latest_ema_long is not None and
                    latest_ema_short > latest_ema_long)
-  # ✅ None 체크 후 포맷팅 또는 'N/A' 출력
-  ema_short_str = f"{latest_ema_short:.2f}" if latest_ema_short is not None else "N/A"
-  ema_long_str = f"{latest_ema_long:.2f}" if latest_ema_long is not None else "N/A"
-  print(f"   - Momentum (EMA) Check: {ema_short_str} > {ema_long_str} -> {'OK' if momentum_ok else 'NG'}")
+  logger.debug("   - Momentum (EMA) Check: {} > {} -> {}", _fmt(latest_ema_short), _fmt(latest_ema_long), 'OK' if momentum_ok else 'NG')
 
   # 체결강도 조건
-  strength_ok = latest_strength is not None and latest_strength >= config.strategy.strength_threshold
-  # ✅ None 체크 후 포맷팅 또는 'N/A' 출력
-  strength_str = f"{latest_strength:.2f}" if latest_strength is not None else "N/A"
-  print(f"   - Strength Check: {strength_str} >= {config.strategy.strength_threshold} -> {'OK' if strength_ok else 'NG'}")
+  strength_ok = latest_strength is not None and latest_strength >= _STRENGTH_THRESHOLD
+  logger.debug("   - Strength Check: {} >= {} -> {}", _fmt(latest_strength), _STRENGTH_THRESHOLD, 'OK' if strength_ok else 'NG')
 
 
   # --- 최종 진입 결정 ---
   if rvol_ok and obi_ok and momentum_ok and strength_ok:
-    print(f"🔥 모든 진입 조건 충족! 매수 신호 발생!")
+    logger.info("🔥 모든 진입 조건 충족! 매수 신호 발생!")
     return "BUY"
   else:
-    print("⚠️ ORB는 돌파했으나 필터 조건 미충족. 진입 보류.")
-    return "HOLD"
\ No newline at end of file
+    logger.debug("⚠️ ORB는 돌파했으나 필터 조건 미충족. 진입 보류.")
+    return "HOLD"
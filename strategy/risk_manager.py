@@ -1,9 +1,26 @@
 # **익절(Take-Profit)**과 손절(Stop-Loss) 규칙을 정의합니다.
 
 import pandas as pd
-from typing import Dict, Optional
+from loguru import logger
+from typing import Dict, Optional, Tuple
 from config.loader import config
 
+# 청산 조건 값 - 포지션마다 틱 단위로 호출되는 manage_position에서 설정 객체 속성을 반복 조회하지 않도록 모듈 변수로 보관
+# (설정은 프로그램 시작 시 한 번만 로드되므로 import 시점의 값으로 고정)
+_TAKE_PROFIT_PCT = config.strategy.take_profit_pct
+_STOP_LOSS_PCT = config.strategy.stop_loss_pct
+_PARTIAL_TAKE_PROFIT_PCT: Optional[float] = config.strategy.partial_take_profit_pct
+_STOP_LOSS_VWAP_PCT: Optional[float] = config.strategy.stop_loss_vwap_pct
+_EMA_SHORT_COL = f'EMA_{config.strategy.ema_short_period}'
+_EMA_LONG_COL = f'EMA_{config.strategy.ema_long_period}'
+
+def _tail2(df: pd.DataFrame, col: str) -> Tuple[Optional[float], Optional[float]]:
+  """컬럼의 (마지막 값, 직전 값)을 numpy 배열에서 바로 읽음. 컬럼이 없으면 (None, None), 한 행뿐이면 직전 값은 None"""
+  if col not in df.columns:
+    return None, None
+  values = df[col].to_numpy()
+  return values[-1], (values[-2] if values.size > 1 else None)
+
 def manage_position(
   position: Dict,
   df: pd.DataFrame
@@ -33,18 +50,14 @@ def manage_position(
   # --- 👇 [수정] 포지션 딕셔너리에서 직접 리스크 설정값을 읽어옵니다. ---
   # config 전역 변수 대신 position에 저장된 값을 사용
   # 만약 값이 없다면 config의 기본값을 안전장치(fallback)로 사용합니다.
-  TAKE_PROFIT_PCT = position.get('target_profit_pct', config.strategy.take_profit_pct)
-  STOP_LOSS_PCT = position.get('stop_loss_pct', config.strategy.stop_loss_pct)
-  PARTIAL_TAKE_PROFIT_PCT = position.get('partial_profit_pct', config.strategy.partial_take_profit_pct)
+  TAKE_PROFIT_PCT = position.get('target_profit_pct', _TAKE_PROFIT_PCT)
+  STOP_LOSS_PCT = position.get('stop_loss_pct', _STOP_LOSS_PCT)
+  PARTIAL_TAKE_PROFIT_PCT = position.get('partial_profit_pct', _PARTIAL_TAKE_PROFIT_PCT)
   # --- 👆 [수정] ---
 
-  current_price = df['close'].iloc[-1]
-  # EMA 컬럼명을 config 값으로 동적 생성
-  ema_short_col = f'EMA_{config.strategy.ema_short_period}'
-  ema_long_col = f'EMA_{config.strategy.ema_long_period}'
-  latest_ema_short = df[ema_short_col].iloc[-1] if ema_short_col in df.columns else None
-  latest_ema_long = df[ema_long_col].iloc[-1] if ema_long_col in df.columns else None
-  latest_vwap = df['vwap'].iloc[-1] if 'vwap' in df.columns else None
+  # 필요한 컬럼의 마지막/직전 값은 해당 조건을 확인할 때 한 번씩만 읽음 (pandas 인덱싱 대신 배열 접근)
+  # 고정 비율 익절/손절은 종가만으로 판단하므로, 먼저 청산되는 경우 EMA/VWAP 컬럼은 읽지 않음
+  current_price, prev_price = _tail2(df, 'close')
 
   profit_pct = ((current_price - entry_price) / entry_price) * 100
 
@@ -53,55 +66,54 @@ def manage_position(
   if (PARTIAL_TAKE_PROFIT_PCT is not None and
       not partial_profit_taken and
       profit_pct >= PARTIAL_TAKE_PROFIT_PCT): # <-- 수정: position에서 읽어온 값 사용
-    print(f"Partial 💰 부분 익절 신호 발생: 현재 수익률({profit_pct:.2f}%) >= 부분 익절 목표({PARTIAL_TAKE_PROFIT_PCT}%)")
+    logger.info("💰 부분 익절 신호 발생: 현재 수익률({:.2f}%) >= 부분 익절 목표({}%)", profit_pct, PARTIAL_TAKE_PROFIT_PCT)
     return "PARTIAL_TAKE_PROFIT" # 부분 익절 신호 반환
 
   # --- 1. 익절 조건 확인 (position 값 사용) ---
   if profit_pct >= TAKE_PROFIT_PCT: # <-- 수정: position에서 읽어온 값 사용
-    print(f"💰 (전체) 익절 신호 발생 (고정 비율): 현재 수익률({profit_pct:.2f}%) >= 목표 수익률({TAKE_PROFIT_PCT}%)")
+    logger.info("💰 (전체) 익절 신호 발생 (고정 비율): 현재 수익률({:.2f}%) >= 목표 수익률({}%)", profit_pct, TAKE_PROFIT_PCT)
     return "TAKE_PROFIT"
 
   # --- 2. 손절 조건 확인 (position 값 사용) ---
   if profit_pct <= STOP_LOSS_PCT: # <-- 수정: position에서 읽어온 값 사용
-    print(f"🛑 손절 신호 발생 (고정 비율): 현재 수익률({profit_pct:.2f}%) <= 손절률({STOP_LOSS_PCT}%)")
+    logger.info("🛑 손절 신호 발생 (고정 비율): 현재 수익률({:.2f}%) <= 손절률({}%)", profit_pct, STOP_LOSS_PCT)
     return "STOP_LOSS"
 
   # --- 3. EMA 데드크로스 청산 조건 확인 ---
+  # EMA 컬럼명은 설정값으로 미리 만들어 둔 이름 사용
+  latest_ema_short, prev_ema_short = _tail2(df, _EMA_SHORT_COL)
+  latest_ema_long, prev_ema_long = _tail2(df, _EMA_LONG_COL)
   if (latest_ema_short is not None and latest_ema_long is not None and
       latest_ema_short < latest_ema_long):
-    if len(df) > 1:
-        prev_ema_short = df[ema_short_col].iloc[-2] 
-        prev_ema_long = df[ema_long_col].iloc[-2]
+    if prev_price is not None: # 직전 봉이 있으면 데드크로스가 이번 봉에서 발생했는지 확인
         if prev_ema_short >= prev_ema_long:
-             print(f"📉 청산 신호 발생 (EMA 데드크로스): EMA 단기({latest_ema_short:.2f}) < EMA 장기({latest_ema_long:.2f})")
+             logger.info("📉 청산 신호 발생 (EMA 데드크로스): EMA 단기({:.2f}) < EMA 장기({:.2f})", latest_ema_short, latest_ema_long)
              return "EMA_CROSS_SELL"
     else:
-        print(f"📉 청산 신호 발생 (EMA 데드크로스): EMA 단기({latest_ema_short:.2f}) < EMA 장기({latest_ema_long:.2f})")
+        logger.info("📉 청산 신호 발생 (EMA 데드크로스): EMA 단기({:.2f}) < EMA 장기({:.2f})", latest_ema_short, latest_ema_long)
         return "EMA_CROSS_SELL"
 
   # --- 4. VWAP 하향 이탈 손절 조건 확인 ---
-  if config.strategy.stop_loss_vwap_pct is not None:
-      vwap_stop_trigger = latest_vwap * (1 - config.strategy.stop_loss_vwap_pct / 100) if latest_vwap else None
+  latest_vwap, prev_vwap = _tail2(df, 'vwap')
+  if _STOP_LOSS_VWAP_PCT is not None:
+      vwap_stop_trigger = latest_vwap * (1 - _STOP_LOSS_VWAP_PCT / 100) if latest_vwap else None
       if vwap_stop_trigger is not None and current_price < vwap_stop_trigger:
-         if len(df) > 1:
-             prev_price = df['close'].iloc[-2]
-             prev_vwap_trigger = (df['vwap'].iloc[-2] * (1 - config.strategy.stop_loss_vwap_pct / 100)) if 'vwap' in df.columns and len(df)>1 else None
-             if prev_vwap_trigger is not None and prev_price >= prev_vwap_trigger:
-                 print(f"📉 청산 신호 발생 (VWAP {config.strategy.stop_loss_vwap_pct}% 이탈): 현재가({current_price}) < VWAP Stop Trigger({vwap_stop_trigger:.2f})")
+         if prev_price is not None:
+             prev_vwap_trigger = prev_vwap * (1 - _STOP_LOSS_VWAP_PCT / 100)
+             if prev_price >= prev_vwap_trigger:
+                 logger.info("📉 청산 신호 발생 (VWAP {}% 이탈): 현재가({}) < VWAP Stop Trigger({:.2f})", _STOP_LOSS_VWAP_PCT, current_price, vwap_stop_trigger)
                  return "VWAP_BREAK_SELL"
          else:
-            print(f"📉 청산 신호 발생 (VWAP {config.strategy.stop_loss_vwap_pct}% 이탈): 현재가({current_price}) < VWAP Stop Trigger({vwap_stop_trigger:.2f})")
+            logger.info("📉 청산 신호 발생 (VWAP {}% 이탈): 현재가({}) < VWAP Stop Trigger({:.2f})", _STOP_LOSS_VWAP_PCT, current_price, vwap_stop_trigger)
             return "VWAP_BREAK_SELL"
   else: 
       if latest_vwap is not None and current_price < latest_vwap:
-         if len(df) > 1:
-             prev_price = df['close'].iloc[-2]
-             prev_vwap = df['vwap'].iloc[-2] if 'vwap' in df.columns else None
-             if prev_vwap is not None and prev_price >= prev_vwap:
-                 print(f"📉 청산 신호 발생 (VWAP 단순 이탈): 현재가({current_price}) < VWAP({latest_vwap:.2f})")
+         if prev_price is not None:
+             if prev_price >= prev_vwap:
+                 logger.info("📉 청산 신호 발생 (VWAP 단순 이탈): 현재가({}) < VWAP({:.2f})", current_price, latest_vwap)
                  return "VWAP_BREAK_SELL"
          else:
-            print(f"📉 청산 신호 발생 (VWAP 단순 이탈): 현재가({current_price}) < VWAP({latest_vwap:.2f})")
+            logger.info("📉 청산 신호 발생 (VWAP 단순 이탈): 현재가({}) < VWAP({:.2f})", current_price, latest_vwap)
             return "VWAP_BREAK_SELL"
 
   return None
\ No newline at end of file